@@ -0,0 +1,284 @@
+__author__ = 'clarkmatthew'
+
+import json
+import operator
+import sqlite3
+import threading
+import time
+from simplecli.filters import ValueMatch
+
+
+class CatalogStore(object):
+    '''
+    Local copy of the image catalog, kept in an SQLite database at 'db_path'
+    so the catalog can be filtered while the catalog url is unreachable.
+    Images are keyed by name, and kept as their catalog json along with
+    indexed columns for the commonly filtered attributes. Values of list
+    attributes (ie hypervisors_supported) are kept in a separate indexed
+    table.
+    Images are listed in their catalog order, kept as each image's
+    'position' in the catalog at the last sync.
+    :param db_path: path of the SQLite database file
+    :param image_class: class used to validate catalog entries and create
+                        the images returned, ie CatalogImage. Called with
+                        each entry and a 'shared_values' dict used for the
+                        entries of one sync or query.
+    '''
+    _schema_version = 2
+    # Filter operators run as SQL, see _get_match_sql()
+    _sql_ops = {operator.eq: '=',
+                operator.lt: '<',
+                operator.le: '<=',
+                operator.gt: '>',
+                operator.ge: '>='}
+
+    def __init__(self, db_path, image_class):
+        self.db_path = db_path
+        self.image_class = image_class
+        self.list_fields = list(image_class._list_fields)
+        self.columns = [field for field in image_class._fields
+                        if field not in self.list_fields and field != 'name']
+        self.indexed = []
+        for field in (['name', 'version'] + image_class._hash_fields +
+                      image_class._sorted_fields):
+            if field not in self.list_fields and field not in self.indexed:
+                self.indexed.append(field)
+        self._connection = None
+        # Commands may be run as background jobs, the connection is shared
+        # between threads but only used by one at a time
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self):
+        with self._lock:
+            if self._connection is None:
+                self._connection = sqlite3.connect(self.db_path,
+                                                   check_same_thread=False)
+                self._create_schema(self._connection)
+            return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _create_schema(self, conn):
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version == self._schema_version:
+            return
+        # Columns hold text values, indexed columns also hold the value as a
+        # number (or NULL) in '<column>_num' for numeric comparisons
+        columns = ['name TEXT PRIMARY KEY']
+        columns += ['{0} TEXT'.format(column) for column in self.columns]
+        columns += ['{0}_num REAL'.format(column) for column in self.indexed]
+        columns.append('position INTEGER NOT NULL')
+        columns.append('data TEXT NOT NULL')
+        with conn:
+            conn.execute('DROP TABLE IF EXISTS images')
+            conn.execute('DROP TABLE IF EXISTS image_values')
+            conn.execute('DROP TABLE IF EXISTS meta')
+            conn.execute('CREATE TABLE images ({0})'
+                         .format(', '.join(columns)))
+            for column in self.indexed:
+                if column != 'name':
+                    conn.execute('CREATE INDEX images_{0} ON images ({0})'
+                                 .format(column))
+                conn.execute('CREATE INDEX images_{0}_num ON images ({0}_num)'
+                             .format(column))
+            conn.execute('CREATE INDEX images_position ON images (position)')
+            conn.execute('CREATE TABLE image_values '
+                         '(name TEXT, attr TEXT, value TEXT)')
+            conn.execute('CREATE INDEX image_values_value ON image_values '
+                         '(attr, value)')
+            conn.execute('CREATE INDEX image_values_name ON image_values '
+                         '(name)')
+            conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            conn.execute('PRAGMA user_version = {0}'
+                         .format(self._schema_version))
+
+    @staticmethod
+    def _to_text(value):
+        if value is None:
+            return None
+        if isinstance(value, unicode):
+            return value
+        if isinstance(value, str):
+            return value.decode('utf-8', 'replace')
+        return unicode(value)
+
+    @staticmethod
+    def _to_number(value):
+        if value is None or value == '':
+            return None
+        try:
+            return float(value)
+        except (ValueError, TypeError):
+            return None
+
+    def _get_row(self, image, j_dict, position):
+        # Returns the values of the images table columns after 'name', in
+        # the order of _get_column_names()
+        row = [self._to_text(getattr(image, column))
+               for column in self.columns]
+        row += [self._to_number(getattr(image, column))
+                for column in self.indexed]
+        row.append(position)
+        row.append(json.dumps(j_dict))
+        return row
+
+    def _get_column_names(self):
+        return (self.columns +
+                ['{0}_num'.format(column) for column in self.indexed] +
+                ['position', 'data'])
+
+    def sync(self, image_dicts, url=None):
+        '''
+        Updates the store from an iterable of catalog image dicts. Only
+        images whose stamp or version changed are written, and images no
+        longer in the catalog are deleted.
+        Returns a dict with the number of images added, updated, deleted and
+        unchanged.
+        '''
+        with self._lock:
+            return self._sync(image_dicts, url=url)
+
+    def _sync(self, image_dicts, url=None):
+        conn = self.connection
+        existing = {}
+        for name, stamp, version, position in conn.execute(
+                'SELECT name, stamp, version, position FROM images'):
+            existing[name] = ((stamp, version), position)
+        counts = {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        names = self._get_column_names()
+        # Rows are updated in place rather than replaced, which would give
+        # them a new rowid
+        insert = ('INSERT INTO images (name, {0}) VALUES (?, {1})'
+                  .format(', '.join(names), ', '.join(['?'] * len(names))))
+        update = ('UPDATE images SET {0} WHERE name = ?'
+                  .format(', '.join('{0} = ?'.format(column)
+                                    for column in names)))
+        seen = set()
+        shared_values = {}
+        with conn:
+            for position, j_dict in enumerate(image_dicts):
+                image = self.image_class(j_dict, shared_values=shared_values)
+                name = self._to_text(image.name)
+                key = (self._to_text(image.stamp),
+                       self._to_text(image.version))
+                row = None
+                if name in seen:
+                    # Repeated name, the last entry in the catalog is kept
+                    counts['updated'] += 1
+                elif name not in existing:
+                    counts['added'] += 1
+                    row = [name] + self._get_row(image, j_dict, position)
+                    conn.execute(insert, row)
+                elif existing[name][0] != key:
+                    counts['updated'] += 1
+                else:
+                    counts['unchanged'] += 1
+                    seen.add(name)
+                    if existing[name][1] != position:
+                        conn.execute('UPDATE images SET position = ? '
+                                     'WHERE name = ?', [position, name])
+                    continue
+                seen.add(name)
+                if row is None:
+                    conn.execute(update, self._get_row(image, j_dict,
+                                                       position) + [name])
+                conn.execute('DELETE FROM image_values WHERE name = ?',
+                             [name])
+                for attr in self.list_fields:
+                    values = getattr(image, attr, None) or []
+                    conn.executemany(
+                        'INSERT INTO image_values VALUES (?, ?, ?)',
+                        [(name, attr, self._to_text(value))
+                         for value in values])
+            deleted = [[name] for name in existing if name not in seen]
+            conn.executemany('DELETE FROM images WHERE name = ?', deleted)
+            conn.executemany('DELETE FROM image_values WHERE name = ?',
+                             deleted)
+            counts['deleted'] = len(deleted)
+            conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                             [('url', url), ('synced', time.time())])
+        return counts
+
+    def get_meta(self):
+        '''
+        Returns a dict with the store's catalog 'url', 'synced' time (None
+        if never synced) and number of 'images'.
+        '''
+        with self._lock:
+            conn = self.connection
+            meta = dict(conn.execute('SELECT key, value FROM meta'))
+            count = conn.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+        synced = meta.get('synced')
+        if synced is not None:
+            synced = float(synced)
+        return {'url': meta.get('url'),
+                'synced': synced,
+                'images': count}
+
+    def _get_match_sql(self, column, match):
+        # Returns the SQL and params for a ValueMatch against 'column', or
+        # None if the match can't be run as SQL
+        if not isinstance(match, ValueMatch) or match.op not in self._sql_ops:
+            return None
+        op = self._sql_ops[match.op]
+        if match.float_value is None:
+            return '{0} {1} ?'.format(column, op), [match.value]
+        # Numeric values compare numerically, others compare as text
+        return ('({0}_num {1} ? OR ({0}_num IS NULL AND {0} {1} ?))'
+                .format(column, op), [match.float_value, match.value])
+
+    def _get_where(self, filters):
+        # Returns the SQL where clauses and params for the filter terms
+        # which can be run as indexed queries
+        clauses = []
+        params = []
+        for attribute_filter in filters.attribute_filters:
+            name = attribute_filter.attr_name
+            if name in self.list_fields:
+                values = [match.value for match in attribute_filter.matches]
+                clauses.append('name IN (SELECT name FROM image_values '
+                               'WHERE attr = ? AND value IN ({0}))'
+                               .format(', '.join(['?'] * len(values))))
+                params += [name] + values
+            elif name in self.indexed:
+                parts = []
+                part_params = []
+                for match in attribute_filter.matches:
+                    sql = self._get_match_sql(name, match)
+                    if sql is None:
+                        break
+                    parts.append(sql[0])
+                    part_params += sql[1]
+                else:
+                    clauses.append('({0})'.format(' OR '.join(parts)))
+                    params += part_params
+        return clauses, params
+
+    def query(self, filters=None):
+        '''
+        Returns the list of images in the store matching 'filters', a
+        simplecli.filters.Filter. Filter terms on indexed attributes are run
+        as SQL, and the images found are then checked against the whole
+        filter.
+        '''
+        sql = 'SELECT data FROM images'
+        params = []
+        if filters:
+            clauses, params = self._get_where(filters)
+            if clauses:
+                sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY position'
+        with self._lock:
+            rows = self.connection.execute(sql, params).fetchall()
+        shared_values = {}
+        images = [self.image_class(json.loads(data),
+                                   shared_values=shared_values)
+                  for (data,) in rows]
+        if filters:
+            images = filters.filter_items(images)
+        return images
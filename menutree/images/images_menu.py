@@ -2,16 +2,16 @@ __author__ = 'clarkmatthew'
 
 
 from simplecli.basemenu import BaseMenu, CliError
-from simplecli.namespace import Namespace
 from simplecli.config import Config
+from simplecli.filters import compile_filter, select_items
+from simplecli.indexes import ItemIndex
+from simplecli.jsonstream import iter_json_array
+from simplecli.columns import ColumnStore
+from menutree.images.catalog_store import CatalogStore
 import os
 import json
-import re
-import copy
-import operator
-import requests
-from texttable import Texttable
-from prettytable import PrettyTable
+from itertools import chain, islice
+from simplecli.table import TableFormat
 
 
 class Images_Menu(BaseMenu):
@@ -32,12 +32,96 @@ class Images_Menu(BaseMenu):
                             name='images')
             config.catalog_url = "http://emis.eucalyptus.com/catalog"
             config.fast_emi_script_url = "eucalyptus.com/install-emis"
+            config.catalog_db = os.path.join(self.env.base_dir,
+                                             'image_catalog.db')
             config._update_from_file(markers=['main'])
             self.env.add_config_to_namespace(namespace_name='main',
                                              config=config,
                                              create=True)
         self._catalog_url = config.catalog_url
         self._fast_emi_script_url = config.fast_emi_script_url
+        self._catalog_db = getattr(config, 'catalog_db', None) or \
+            os.path.join(self.env.base_dir, 'image_catalog.db')
+        self._catalog_store = None
+        # Last catalog body read and the json, images and image index
+        # loaded from it
+        self._catalog_body = None
+        self._catalog_json = None
+        self._catalog_images = None
+        self._catalog_index = None
+        self._catalog_columns = None
+
+    def _get_catalog_json(self, refresh=False):
+        """
+        Returns the image catalog json fetched from the catalog url.
+        Responses are kept in the env's http cache and revalidated once
+        older than the cache ttl, use 'refresh' to fetch the catalog again.
+        """
+        body = self.env.http_cache.get(self._catalog_url, refresh=refresh,
+                                       session=self.env.http_client)
+        if body is not self._catalog_body:
+            self._catalog_json = json.loads(body)
+            self._catalog_images = None
+            self._catalog_index = None
+            self._catalog_columns = None
+            self._catalog_body = body
+        return self._catalog_json
+
+    def _get_catalog_images(self, refresh=False):
+        """
+        Returns the list of CatalogImages from the image catalog, and an
+        ItemIndex over their commonly filtered attributes. Both are reused
+        until the catalog changes.
+        """
+        j = self._get_catalog_json(refresh=refresh)
+        if self._catalog_images is None:
+            # Create image_j objects from the json provided. Use image_j
+            # versioned validators to verify json and/or provide sane
+            # defaults, etc..
+            images = []
+            # Values are shared between the images of this load only
+            shared_values = {}
+            if 'images' in j:
+                for image in j['images']:
+                    images.append(CatalogImage(image,
+                                               shared_values=shared_values))
+            self._catalog_index = ItemIndex(
+                images,
+                hash_fields=CatalogImage._hash_fields,
+                sorted_fields=CatalogImage._sorted_fields)
+            self._catalog_images = images
+            self._catalog_columns = None
+        return self._catalog_images, self._catalog_index
+
+    def _get_catalog_columns(self, refresh=False):
+        """
+        Returns a ColumnStore over the catalog images, for catalog_stats.
+        Like the images, it is reused until the catalog changes.
+        """
+        self._get_catalog_images(refresh=refresh)
+        if self._catalog_columns is None:
+            self._catalog_columns = ColumnStore(self._catalog_images)
+        return self._catalog_columns
+
+    def _get_catalog_store(self):
+        """
+        Returns the local catalog store, see sync_catalog.
+        """
+        if self._catalog_store is None:
+            self._catalog_store = CatalogStore(self._catalog_db,
+                                               image_class=CatalogImage)
+        return self._catalog_store
+
+    def _iter_catalog_images(self, refresh=False):
+        """
+        Yields CatalogImages as they are parsed from the image catalog
+        response, without waiting for the rest of the catalog.
+        """
+        chunks = self.env.http_cache.iter_content(
+            self._catalog_url, refresh=refresh, session=self.env.http_client)
+        shared_values = {}
+        for image in iter_json_array(chunks, key='images'):
+            yield CatalogImage(image, shared_values=shared_values)
 
     def do_install_quick_image(self, args):
         """
@@ -80,7 +164,7 @@ class Images_Menu(BaseMenu):
             self.eprint('Could not load html2text, '
                         'try installing with pip install html2text')
         else:
-            r = requests.get("http://emis.eucalyptus.com")
+            r = self.env.http_client.get("http://emis.eucalyptus.com")
             buf = ""
             doc = html2text.html2text(r.text.encode('ascii', 'ignore').decode('ascii'))
             for line in doc.splitlines():
@@ -95,13 +179,11 @@ class Images_Menu(BaseMenu):
         Shows URLs currently used for local image utlities/cmds
         """
         self.oprint(self._color("\n\t***** CURRENT IMAGE MENU URLS *****"))
-        tab = Texttable()
-        table = [['NAME', 'URL']]
+        table = []
         table.append(['FAST EMI SCRIPT', self._fast_emi_script_url])
         table.append(['IMAGE CATALOG', self._catalog_url])
-        tab.add_rows(table)
-        tab.set_cols_dtype(['t','t'])
-        self.oprint(tab.draw())
+        table.append(['LOCAL CATALOG', self._catalog_db])
+        self.oprint(self.draw_table(table, header=['NAME', 'URL']))
 
 
     def do_set_catalog_url(self, url):
@@ -134,120 +216,276 @@ class Images_Menu(BaseMenu):
             -re.search, -re.match, etc..
         default operator is -eq (equal)
 
-        Usage: show_catalog [filters]
+        Usage: show_catalog [--refresh] [--stream] [--local]
+                            [--sort attr[,desc]] [--limit N] [--offset N]
+                            [filters]
+        Use --refresh to fetch the catalog instead of using the cached copy.
+        Use --local to query the local catalog, without using the network.
+        The local catalog is updated with sync_catalog.
+        Use --stream to show matching images as the catalog is read, instead
+        of after the whole catalog has been loaded.
+        Use --sort to order the images by an attribute, add ',desc' for
+        descending order. Use --limit and --offset to show only N images,
+        after skipping the first N.
         Examples:
                 show_catalog os=cirros,centos
 
                 show_catalog date=-gt:20120517102326 os=ubuntu size=-lt:5
 
                 show_catalog description:-re.search:'random text'
+
+                show_catalog --sort date,desc --limit 10 os=ubuntu
         """
-        filter_list = filtersarg.split()
-        filters = {}
-        for item in filter_list:
-            try:
-                filter, values = item.split('=')
-                values = values.split(',')
-                filters[filter] = values
-            except Exception as e:
-                raise CliError(
-                    'Could not parse filter argument:"{0}", error:"{1}"'
-                    .format(item, str(e)))
-        # Get the image catalog from the catalog url and create image_j
-        # objects from the json provided. Use image_j versioned validators
-        # to verify json and/or provide sane defaults, etc..
-        r = requests.get(self._catalog_url)
-        j = json.loads(r.text)
-        images = []
-        if 'images' in j:
-            for image in j['images']:
-                images.append(CatalogImage(image))
-        show_images = copy.copy(images)
-        for image in images:
-            for filter in filters:
-                match = False
-                # See if the image has an attribute that matches
-                # Note: Replace '-' with '_' for image attribute lookups
-                # as they are renamed in the class
-                image_attr = getattr(image, str(filter).replace('-','_'))
-                if image_attr:
-                    # iterate through any filters provided from the command line
-                    # if an image fails to meet the criteria of any filter
-                    # it will be removed from the display list
-                    for value in filters[filter]:
-                        # Check if filter is using a normal
-                        # operator ie: -eq, -gt, ex: filter=-eq:words
-                        op = re.search("^-+\w\w:", value)
-                        if op:
-                            mod = operator
-                        else:
-                            # Check if filter is using reg ex in filter
-                            # ie: filter=-re.search:expression
-                            op = re.search("^-+re.\w+:", value)
-                            if op:
-                                mod = re
-                        if op:
-                            opstr = op.group()
-                            value = value.replace(opstr, '')
-                            op = opstr.replace('-','').strip(':')
-                            op = op.replace('re.','')
-                            op = getattr(mod, op, None)
-                            if not op:
-                                self.eprint('Warning: operator "{0}" ({1}) '
-                                            'not valid? for mod:"{2}"'
-                                            .format(op, opstr, mod))
-                        # If an operator was not provided or was invalid,
-                        # use the default op for 'equals'
-                        op = op or operator.eq
-                        # This can be improved to do more complex lookups and
-                        # inspection, for now only handling lists and
-                        # instances.
-                        if isinstance(image_attr, list):
-                            if value in image_attr:
-                                match = True
-                                break
-                        else:
-                            # Evaluate each item against the filters...
-                            if getattr(op, '__module__', None) == 'operator':
-                                # Using operator.<func>
-                                try:
-                                    if op(float(image_attr), float(value)):
-                                        match = True
-                                        break
-                                except:
-                                    if op(image_attr, value):
-                                        match = True
-                                        break
-                            else:
-                                # Using re.<func>
-                                if op(value, str(image_attr)):
-                                    match = True
-                                    break
-                if not match:
-                    show_images.remove(image)
-                    break
+        options, filter_list = self._parse_catalog_args(
+            filtersarg,
+            options={'--refresh': False,
+                     '--stream': False,
+                     '--local': False,
+                     '--sort': None,
+                     '--limit': None,
+                     '--offset': 0},
+            int_options=['--limit', '--offset'])
+        refresh = options['--refresh']
+        try:
+            filters = compile_filter(filter_list, warn=self.eprint)
+        except Exception as e:
+            raise CliError(str(e))
+        if options['--local']:
+            store = self._get_catalog_store()
+            if store.get_meta()['synced'] is None:
+                raise CliError('Local catalog has not been synced, '
+                               'run sync_catalog first')
+            images = self._select_catalog_images(store.query(filters),
+                                                 options)
+        elif options['--stream']:
+            # Images are filtered and printed as they are read, unless they
+            # need sorting first
+            images = (image for image in
+                      self._iter_catalog_images(refresh=refresh)
+                      if filters(image))
+            if options['--sort']:
+                images = self._select_catalog_images(images, options)
+            else:
+                end = None
+                if options['--limit'] is not None:
+                    end = options['--offset'] + options['--limit']
+                images = islice(images, options['--offset'], end)
+        else:
+            # Get the image catalog from the catalog url
+            images, index = self._get_catalog_images(refresh=refresh)
+            # Images which fail to meet the criteria of any filter are left
+            # out of the display list
+            images = self._select_catalog_images(
+                filters.filter_items(images, index=index), options)
         # Now format and print the images...
-        if not show_images:
+        images = iter(images)
+        first = next(images, None)
+        if first is None:
             self.eprint('No images for filters:' + str(filters))
-        for image in show_images:
-            summary = image.get_summary_full()
+            return
+        # Images are drawn as the pager asks for more output
+        self.ostream(self._iter_image_bufs(chain([first], images)))
+
+    def _parse_catalog_args(self, args, options, int_options=None):
+        """
+        Separates a catalog command's options from its filters.
+        'options' is a dict of option names to their defaults. Options
+        defaulting to False are flags, others take a value. The values of
+        'int_options' must be positive integers.
+        Returns a dict of options and the list of filter terms.
+        """
+        options = dict(options)
+        int_options = int_options or []
+        filter_list = []
+        words = iter(args.split())
+        for word in words:
+            if options.get(word) is False:
+                options[word] = True
+                continue
+            name, sep, value = word.partition('=')
+            if not name.startswith('--') or name not in options:
+                filter_list.append(word)
+                continue
+            if not sep:
+                value = next(words, None)
+            if not value:
+                raise CliError('Option "{0}" requires a value'.format(name))
+            if name in int_options:
+                try:
+                    value = int(value)
+                    if value < 0:
+                        raise ValueError()
+                except ValueError:
+                    raise CliError('Option "{0}" requires a positive integer, '
+                                   'got:"{1}"'.format(name, value))
+            options[name] = value
+        return options, filter_list
+
+    def _select_catalog_images(self, images, options):
+        """
+        Returns the images selected by the --sort, --limit and --offset
+        options. Only the selected images are kept, so only they get
+        rendered.
+        """
+        sort = options['--sort']
+        reverse = False
+        if sort:
+            sort, sep, order = sort.partition(',')
+            if order not in ['', 'asc', 'desc']:
+                raise CliError('Unknown sort order:"{0}", expected "asc" or '
+                               '"desc"'.format(order))
+            reverse = order == 'desc'
+        return select_items(images,
+                            sort=sort,
+                            reverse=reverse,
+                            limit=options['--limit'],
+                            offset=options['--offset'])
+
+    def do_sync_catalog(self, args):
+        """
+        Updates the local catalog from the catalog url. Only images whose
+        stamp or version changed are written, and images no longer in the
+        catalog are removed. The local catalog can be queried without the
+        network using show_catalog --local.
+        Usage: sync_catalog [--refresh]
+        Use --refresh to fetch the catalog instead of using the cached copy.
+        """
+        refresh = '--refresh' in args.split()
+        store = self._get_catalog_store()
+        chunks = self.env.http_cache.iter_content(
+            self._catalog_url, refresh=refresh, session=self.env.http_client)
+        counts = store.sync(iter_json_array(chunks, key='images'),
+                            url=self._catalog_url)
+        meta = store.get_meta()
+        table = [['LOCAL CATALOG', self._catalog_db],
+                 ['IMAGES', str(meta['images'])]]
+        for name in ['added', 'updated', 'deleted', 'unchanged']:
+            table.append([name.upper(), str(counts[name])])
+        self.oprint(self.draw_table(table))
+
+    # Number of date chars to group by for 'catalog_stats --by date:<period>'
+    _date_periods = {'year': 4, 'month': 6, 'day': 8}
+
+    def do_catalog_stats(self, args):
+        """
+        Shows counts and aggregates over the images in the catalog, or over
+        the images matching the filters (see show_catalog for the format).
+        Shows the number of images and their date range, and optionally:
+        --by attr           the number of images per attribute value. For
+                            dates use --by date:year, date:month or date:day
+        --hist attr[,bins]  a histogram of a numeric attribute's values, in
+                            'bins' equal width bins (default 10)
+        Usage: catalog_stats [--refresh] [--by attr] [--hist attr[,bins]]
+                             [filters]
+        Examples:
+                catalog_stats --by os
+
+                catalog_stats --by date:month os=ubuntu
+        """
+        options, filter_list = self._parse_catalog_args(
+            args,
+            options={'--refresh': False,
+                     '--by': None,
+                     '--hist': None})
+        by = None
+        if options['--by']:
+            name, sep, period = options['--by'].partition(':')
+            prefix = None
+            if period:
+                prefix = self._date_periods.get(period)
+                if not prefix:
+                    raise CliError('Unknown period:"{0}", expected one of: {1}'
+                                   .format(period,
+                                           ', '.join(sorted(self._date_periods))))
+            by = (name, prefix)
+        hist = None
+        if options['--hist']:
+            name, sep, bins = options['--hist'].partition(',')
+            try:
+                bins = int(bins or 10)
+                if bins < 1:
+                    raise ValueError()
+            except ValueError:
+                raise CliError('Histogram bins must be a positive integer, '
+                               'got:"{0}"'.format(bins))
+            hist = (name, bins)
+        try:
+            filters = compile_filter(filter_list, warn=self.eprint)
+        except Exception as e:
+            raise CliError(str(e))
+        columns = self._get_catalog_columns(refresh=options['--refresh'])
+        positions = None
+        if filters:
+            positions = filters.filter_positions(self._catalog_images,
+                                                 index=self._catalog_index)
+        if hist:
+            # Check the attribute is numeric before showing anything
+            try:
+                histogram = columns.histogram(hist[0], positions=positions,
+                                              bins=hist[1])
+            except ValueError as e:
+                raise CliError(str(e))
+        count = len(columns)
+        if positions is not None:
+            count = len(positions)
+        table = [['IMAGES', str(count)]]
+        if filters:
+            table.append(['FILTERS', str(filters)])
+        low, high = columns.min_max('date', positions=positions,
+                                    numeric=False)
+        table.append(['OLDEST DATE', str(low)])
+        table.append(['NEWEST DATE', str(high)])
+        self.oprint(self.draw_table(table))
+        if by:
+            counts = columns.group_counts(by[0], positions=positions,
+                                          prefix=by[1])
+            self.oprint(self._get_counts_table(options['--by'].upper(),
+                                               counts))
+        if hist:
+            counts = [('{0:.15g} - {1:.15g}'.format(low, high), count)
+                      for (low, high), count in histogram]
+            self.oprint(self._get_counts_table(hist[0].upper(), counts))
+
+    def _get_counts_table(self, title, counts, width=30):
+        """
+        Returns a table of (value, count) tuples, with bars scaled to the
+        largest count.
+        """
+        table = []
+        most = max([count for value, count in counts] or [0])
+        for value, count in counts:
+            bar = ''
+            if most:
+                bar = '#' * int(round(width * count / float(most)))
+            table.append([value, count, bar])
+        return self.draw_table(table, header=[title, 'COUNT', ''],
+                               align=['l', 'r', 'l'])
+
+    def _iter_image_bufs(self, images):
+        """
+        Yields the output for each image in 'images', a header with the
+        image's name followed by a table of its attributes.
+        """
+        table_format = self.get_table_format(
+            header=['IMAGE ATTRIBUTE', 'VALUE'])
+        for image in images:
+            summary = image.get_summary_full(table_format=table_format)
             if summary:
-                line_len = len(summary.splitlines()[0])
-                line = ""
-                for x in xrange(0, line_len):
-                    line += '#'
-                line += '\n'
+                line_len = summary.find('\n')
+                if line_len < 0:
+                    line_len = len(summary)
+                line = '#' * line_len + '\n'
                 header = "\n\n" + line
                 header += ('{0}\n'
                            .format(self._color(image.name).center(line_len)))
                 header += line
-                self.oprint(header)
-                self.oprint(image.get_summary_full())
+                yield header
+                yield summary
 
 
 
 
-class CatalogImage(Namespace):
+class CatalogImage(object):
     '''
     Populate attributes from provided JSON string, or dict.
     If version is provided attempt to do some basic verification on the
@@ -257,57 +495,120 @@ class CatalogImage(Namespace):
     The validation methods can be used for type casting, or further building
     out the image instance...
 
-    Note: JSON attributes may need the chars converted from  '-' to '_' when
+    Note: JSON attributes have the chars converted from  '-' to '_' when
      creating the image attributes.
-    '''
 
-    def __init__(self, j_dict):
+    Catalogs can hold many images, so the known catalog attributes are kept
+    in slots rather than a per instance dict, and values repeated across
+    images (os, architecture, etc) are shared between instances. Any other
+    JSON attributes are kept in the 'extras' dict, and can still be read as
+    attributes.
+    :param j_dict: catalog image dict, or its JSON
+    :param shared_values: optional dict of the values shared so far, used for
+                          all the images of one catalog load. The dict is
+                          only needed during the load.
+    '''
+    _fields = ['architecture', 'contact', 'date', 'description',
+               'hypervisors_supported', 'name', 'os', 'recipe',
+               'single_kernel', 'stamp', 'url', 'version']
+    __slots__ = _fields + ['extras']
+    # Attributes indexed for show_catalog filters, see simplecli.indexes
+    _hash_fields = ['os', 'architecture', 'hypervisors_supported']
+    _sorted_fields = ['date', 'stamp']
+    # Attributes holding lists of values
+    _list_fields = ['hypervisors_supported']
+    def __init__(self, j_dict, shared_values=None):
         # if j_dict is a string then assume it's json and attempt to convert it
         # to a dict
-        if isinstance(j_dict, str):
+        if isinstance(j_dict, basestring):
             j_dict = json.loads(j_dict)
-        #Load all attributes from dict into self...
-        self.version = None
-        super(CatalogImage, self).__init__(newdict=j_dict)
+        self.extras = {}
+        for field in self._fields:
+            setattr(self, field, None)
         #See if there's a validation/init method for this specific version...
-        validation_method = None
-        if not self.version:
-            validation_method = getattr(
-                self, '_validation_method_' + j_dict['version'])
+        validation_method = getattr(
+            self, '_validation_method_' + str(j_dict.get('version')), None)
+        if shared_values is None:
+            shared_values = {}
         if not validation_method:
-            self._validate_default(j_dict)
+            self._validate_default(j_dict, shared_values)
         else:
-            validation_method(j_dict)
+            validation_method(j_dict, shared_values)
+        #Keep any remaining attributes from the dict in extras...
+        for key in j_dict:
+            name = str(key).replace('-', '_')
+            if name not in self.__slots__:
+                self.extras[name] = j_dict[key]
+
+    def __getattr__(self, name):
+        # Only called when 'name' is not a slot, look for it in extras
+        try:
+            extras = object.__getattribute__(self, 'extras')
+            return extras[name.replace('-', '_')]
+        except (AttributeError, KeyError):
+            raise AttributeError('"{0}" object has no attribute "{1}"'
+                                 .format(self.__class__.__name__, name))
+
+    @staticmethod
+    def _share(value, shared_values):
+        '''
+        Returns a single shared copy, kept in 'shared_values', of values
+        repeated across many images. Lists are shared as well, and must not
+        be modified in place.
+        '''
+        if isinstance(value, list):
+            key = ('list', tuple(value))
+            value = [CatalogImage._share(x, shared_values) for x in value]
+        else:
+            key = value
+        try:
+            return shared_values.setdefault(key, value)
+        except TypeError:
+            # Unhashable value
+            return value
 
-    def _validate_default(self, j_dict):
-        self._validate_method_1(j_dict)
+    def _validate_default(self, j_dict, shared_values):
+        self._validate_method_1(j_dict, shared_values)
 
-    def _validate_method_1(self, j_dict):
+    def _validate_method_1(self, j_dict, shared_values):
         '''
         Intends to validate a minimum set of attributes provided by the
         dict/json.
         '''
-        self.architecture = j_dict['architecture']
-        self.contact = j_dict['contact']
+        share = lambda value: self._share(value, shared_values)
+        self.architecture = share(j_dict['architecture'])
+        self.contact = share(j_dict['contact'])
         self.date = j_dict['date']
         self.description = j_dict['description']
-        self.hypervisors_supported = j_dict['hypervisors-supported']
+        self.hypervisors_supported = share(j_dict['hypervisors-supported'])
         self.name = j_dict['name']
-        self.os = j_dict['os']
-        self.recipe = j_dict['recipe']
+        self.os = share(j_dict['os'])
+        self.recipe = share(j_dict['recipe'])
         self.single_kernel = j_dict['single-kernel']
         self.stamp = j_dict['stamp']
         self.url = j_dict['url']
-        self.version = j_dict['version']
-
-    def get_summary_full(self):
-        table = [['IMAGE ATTRIBUTE', 'VALUE']]
-        tab = Texttable()
-        tab.set_cols_dtype(['t','t'])
-        for key in self.__dict__:
-            table.append([str(key), str(self.__dict__[key])])
-        tab.add_rows(table)
-        return tab.draw()
+        self.version = share(j_dict['version'])
+
+    def to_dict(self):
+        '''
+        Returns a dict of this image's attributes, including extras.
+        '''
+        ret = {}
+        for field in self._fields:
+            ret[field] = getattr(self, field)
+        ret.update(self.extras)
+        return ret
+
+    def get_summary_full(self, table_format=None):
+        '''
+        Returns a table of this image's attributes.
+        :param table_format: optional TableFormat to draw the table with,
+                             ie a menu's get_table_format(), for images
+                             listed together
+        '''
+        table_format = table_format or TableFormat(
+            header=['IMAGE ATTRIBUTE', 'VALUE'])
+        return table_format.draw(sorted(self.to_dict().iteritems()))
 
 
 
@@ -18,6 +18,9 @@ setup(name = "simplecli",
       url = "http://open.eucalyptus.com",
       install_requires = [],
       packages = find_packages(),
+      entry_points = {
+          'console_scripts': ['simplecli = simplecli.oneshot:main'],
+      },
       license = 'BSD (Simplified)',
       platforms = 'Posix; MacOS X;',
       classifiers = [ 'Development Status :: 3 - Alpha',
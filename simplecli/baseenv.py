@@ -7,21 +7,52 @@ import imp
 from namespace import Namespace
 from simplecli import get_dict_from_file
 from config import Config
+from plugins import PluginMenu, PluginCache
+from registry import MenuRegistry
+from jobs import JobManager
+from httpcache import ResponseCache
+from httpclient import HttpClient
+from terminal import TerminalSize
+from output import OutputBuffer, OutputGroup
+from tracing import Tracer
+from profiler import CommandProfiler
 from shutil import copyfile
 import json
 
 
-class BaseEnv():
+class BaseEnv(object):
     """
     The intention of this class is to hold environment variables which might be
     global to the tool, it's menus, and the command executed within.
     """
     def __init__(self,
                  base_dir=None,
-                 name='simplecli'):
+                 name='simplecli',
+                 interactive=True):
         self.name = name
+        # When False, menus do not setup readline history, colors or
+        # the ctrl-c handler. Used when running commands non-interactively.
+        self.interactive = interactive
         self._config_namespaces = Namespace()
-        self.menu_instances = []
+        self.menu_registry = MenuRegistry()
+        self.plugin_menus = []
+        # Incremented each time plugin menus are added, used by menus to
+        # tell when their sub menus need updating
+        self.plugin_version = 0
+        # The menu currently read from by the running input loop, if any
+        self.active_menu = None
+        # Last error caught while running a command, see BaseMenu.onecmd()
+        self.last_error = None
+        # Commands running in the background, see BaseMenu.onecmd()
+        self.jobs = JobManager()
+        self._http_cache = None
+        self._http_client = None
+        self._terminal = None
+        # Buffered menu output per stream, see get_output()
+        self._outputs = {}
+        self._output_group = OutputGroup()
+        self._tracer = None
+        self._profiler = None
         self.base_dir = base_dir or os.path.expanduser('~/.simplecli')
         if os.path.exists(self.base_dir):
             if not os.path.isdir(self.base_dir):
@@ -37,6 +68,121 @@ class BaseEnv():
         self._load_plugin_menus()
 
 
+    @property
+    def menu_instances(self):
+        '''
+        The loaded menu instances. This is the env's MenuRegistry, which can
+        be used as a list of menus.
+        '''
+        return self.menu_registry
+
+    @menu_instances.setter
+    def menu_instances(self, menus):
+        self.menu_registry = MenuRegistry(menus)
+
+    @property
+    def http_cache(self):
+        '''
+        ResponseCache shared by menus for HTTP GETs, created on first use
+        from the 'http_cache_*' simplecli config values.
+        '''
+        if self._http_cache is None:
+            config = self.simplecli_config
+            self._http_cache = ResponseCache(
+                cache_dir=config.http_cache_dir,
+                ttl=config.http_cache_ttl,
+                max_bytes=config.http_cache_max_bytes)
+        return self._http_cache
+
+    @property
+    def http_client(self):
+        '''
+        HttpClient shared by menus, created on first use from the 'http_*'
+        simplecli config values.
+        '''
+        if self._http_client is None:
+            config = self.simplecli_config
+            self._http_client = HttpClient(
+                connect_timeout=config.http_connect_timeout,
+                read_timeout=config.http_read_timeout,
+                retries=config.http_retries,
+                backoff=config.http_retry_backoff,
+                max_per_host=config.http_max_per_host,
+                pool_size=config.http_pool_size)
+        return self._http_client
+
+    @property
+    def terminal(self):
+        '''
+        TerminalSize of the env's default output, shared by menus for
+        paging and formatting output. When interactive, it is kept up to
+        date from a SIGWINCH handler.
+        '''
+        if self._terminal is None:
+            self._terminal = TerminalSize(stream=self.default_output)
+            if self.interactive:
+                self._terminal.watch()
+        return self._terminal
+
+    @property
+    def tracer(self):
+        '''
+        Tracer shared by menus for debug tracing, see simplecli.tracing.
+        Configured from the 'trace_*' simplecli config values, see
+        configure_tracer().
+        '''
+        if self._tracer is None:
+            self._tracer = Tracer(stream=self.get_output(self.default_error))
+            self.configure_tracer()
+        return self._tracer
+
+    def configure_tracer(self):
+        '''
+        Applies the 'trace_*' simplecli config values to the tracer. With
+        'debug' set and no 'trace_level', all categories are traced at the
+        'debug' level.
+        '''
+        config = self.simplecli_config
+        level = config.trace_level
+        if level is None and config.debug:
+            level = 'debug'
+        self.tracer.configure(level=level,
+                              categories=config.trace_categories,
+                              path=config.trace_file)
+
+    @property
+    def profiler(self):
+        '''
+        CommandProfiler menus run commands with, see BaseMenu.onecmd().
+        Disabled until enabled with Config_Menu's set_profile command.
+        '''
+        if self._profiler is None:
+            self._profiler = CommandProfiler()
+        return self._profiler
+
+    def get_output(self, stream):
+        '''
+        Returns the OutputBuffer menus write to 'stream' through, shared by
+        all menus writing to it. Only file objects (ie sys.stdout) are
+        buffered, other file like objects are returned as is, as are all
+        streams when the 'output_buffer_size' config value is 0.
+        '''
+        buffer_size = self.simplecli_config.output_buffer_size
+        if not buffer_size or not isinstance(stream, file):
+            return stream
+        output = self._outputs.get(id(stream))
+        if output is None:
+            output = OutputBuffer(stream, buffer_size=buffer_size,
+                                  group=self._output_group)
+            self._outputs[id(stream)] = output
+        return output
+
+    def flush_output(self):
+        '''
+        Writes out the output buffered for menus, see get_output().
+        '''
+        self._output_group.flush()
+
     def _setup_stdio(self):
         def _get_stdio(name):
             if hasattr(sys, name):
@@ -65,9 +211,41 @@ class BaseEnv():
         simplecli = Config(config_file_path=self.simplecli_config_file,
                            name='simplecli')
         simplecli.debug = False
+        simplecli.trace_level = None # ie 'debug', 'info', 'warning' or 'error'
+        simplecli.trace_categories = 'all' # Comma separated categories to
+                                           # trace, ie 'completion,dispatch'
+        simplecli.trace_file = None # Append trace messages to this file
+                                    # instead of writing them to stderr
         simplecli.history_file = os.path.join(self.base_dir, 'history')
+        # Dir pstats files of profiled commands are written to, see
+        # Config_Menu's set_profile command
+        simplecli.profile_dir = os.path.join(self.base_dir, 'profiles')
         simplecli.page_break = True
+        simplecli.output_buffer_size = 65536 # Bytes of menu output buffered
+                                             # between flushes, 0 to disable
+        # Cache of HTTP responses fetched by menus, see http_cache
+        simplecli.http_cache_dir = os.path.join(self.base_dir, 'http_cache')
+        simplecli.http_cache_ttl = 300 # Seconds before revalidating
+        simplecli.http_cache_max_bytes = 50 * 1024 * 1024
+        # Shared HTTP client settings, see http_client
+        simplecli.http_connect_timeout = 5 # Seconds
+        simplecli.http_read_timeout = 30 # Seconds
+        simplecli.http_retries = 3
+        simplecli.http_retry_backoff = 0.5 # Backoff factor between retries
+        simplecli.http_max_per_host = 4 # Max concurrent requests per host
+        simplecli.http_pool_size = 10 # Connection pools kept per client
+        simplecli.batch_stop_on_error = False # Stop batch scripts upon the
+                                              # first failed command
+        simplecli.max_completions = None # Limit the number of tab completion
+                                         # matches returned, None for all
         simplecli.plugin_dir = None
+        simplecli.home_menu = None # Home menu class used by the simplecli
+                                   # command, ie 'mypackage.mymodule.MyMenu'
+        simplecli.lazy_plugins = True # Defer importing plugin menus until
+                                      # they are first used
+        # Cache of plugin discovery info used with lazy_plugins
+        simplecli.plugin_cache_file = os.path.join(self.base_dir,
+                                                   'plugin_cache')
 
         simplecli.default_input = 'stdin' # ie stdin
         simplecli.default_output = 'stdout' # ie stdout or stderr
@@ -157,48 +335,103 @@ class BaseEnv():
         with save_file:
             save_file.write(config_json)
             save_file.flush()
+        self.tracer.config.info('Saved config to "{0}"', path)
 
     def _load_plugin_menus(self):
         '''
         Loads plugin menus found either in the provided plugin directory
         or the current working dir. Will attempt to load files starting
         with 'menu'. See plugin examples for more info.
+        If 'lazy_plugins' is set, plugins are registered using only the info
+        read from the plugin file and their menu class definition. The
+        plugin menu is then imported and created the first time it is used.
+        Plugin info for unchanged plugin files is read from the plugin cache
+        file if 'plugin_cache_file' is set.
         '''
         self.plugin_menus = []
+        self.plugin_version += 1
         plugin_dir = self.simplecli_config.plugin_dir or os.path.curdir
+        cache = None
+        if (self.simplecli_config.lazy_plugins and
+                self.simplecli_config.plugin_cache_file):
+            cache = PluginCache(self.simplecli_config.plugin_cache_file)
+        plugin_paths = []
         for file in os.listdir(plugin_dir):
-            if (os.path.isfile(file) and file.startswith('menu')
+            full_path = os.path.join(plugin_dir, file)
+            if (os.path.isfile(full_path) and file.startswith('menu')
                 and file.endswith('.py')):
-                full_path = os.path.join(plugin_dir, file)
-                p_name = os.path.basename(file).rstrip('.py')
-                plugmod = imp.load_source(p_name, full_path)
-                menuclass = getattr(plugmod, 'menu_class', None)
-                if not menuclass:
-                    raise AttributeError('"{0}". Plugin conf does not have '
-                                         'a "menu_class" attribute. See plugin'
-                                         'example for info.'
-                                         .format(full_path))
-                plugin = menuclass(env=self)
-                existing_menu = self.get_menu_by_class(plugin.__class__)
-                if existing_menu:
-                    raise RuntimeError('Duplicate Menu Classes found while'
-                                       'loading plugins: class:"{0}", '
-                                       'menu:"{1}", plugin:"{2}", file:"{3}"'
-                                       .format(plugin.__class__,
-                                               existing_menu.name,
-                                               plugin.name,
-                                               full_path))
-                parent_menus =  getattr(plugmod, 'parent_menus', None)
-                if parent_menus:
-                    plugin._parents = parent_menus
-                self.plugin_menus.append(plugin)
+                plugin_paths.append(full_path)
+                plugin = None
+                if self.simplecli_config.lazy_plugins:
+                    plugin = PluginMenu.from_file(full_path, env=self,
+                                                  cache=cache)
+                if plugin:
+                    for existing in self.plugin_menus:
+                        if (isinstance(existing, PluginMenu) and
+                                existing.class_path == plugin.class_path):
+                            raise RuntimeError(
+                                'Duplicate Menu Classes found while loading '
+                                'plugins: class:"{0}", plugin:"{1}", '
+                                'file:"{2}"'.format(plugin.class_path,
+                                                    plugin.name,
+                                                    full_path))
+                else:
+                    plugin = self._import_plugin_menu(full_path)
+                self.tracer.plugins.debug('Loaded plugin menu "{0}" from '
+                                          '"{1}"', plugin.name, full_path)
+                self.add_plugin_menu(plugin)
+        if cache:
+            cache.prune(plugin_paths)
+            try:
+                cache.save()
+            except IOError as IE:
+                print >> sys.stderr, ('Failed to write plugin cache:"{0}", '
+                                      'err:"{1}"'.format(cache.file_path, IE))
+
+    def add_plugin_menu(self, plugin):
+        '''
+        Adds a plugin menu (a BaseMenu or PluginMenu) to the env. Menus pick
+        up new plugins for them the next time their sub menus are
+        initialized.
+        '''
+        self.plugin_menus.append(plugin)
+        self.plugin_version += 1
+
+    def _import_plugin_menu(self, full_path):
+        '''
+        Imports the plugin file at 'full_path' and returns an instance of the
+        plugin's menu class.
+        '''
+        p_name = os.path.splitext(os.path.basename(full_path))[0]
+        plugmod = imp.load_source(p_name, full_path)
+        menuclass = getattr(plugmod, 'menu_class', None)
+        if not menuclass:
+            raise AttributeError('"{0}". Plugin conf does not have '
+                                 'a "menu_class" attribute. See plugin'
+                                 'example for info.'
+                                 .format(full_path))
+        plugin = menuclass(env=self)
+        existing_menu = self.get_menu_by_class(plugin.__class__)
+        if existing_menu:
+            raise RuntimeError('Duplicate Menu Classes found while'
+                               'loading plugins: class:"{0}", '
+                               'menu:"{1}", plugin:"{2}", file:"{3}"'
+                               .format(plugin.__class__,
+                                       existing_menu.name,
+                                       plugin.name,
+                                       full_path))
+        parent_menus =  getattr(plugmod, 'parent_menus', None)
+        if parent_menus:
+            plugin._parents = parent_menus
+        return plugin
 
     def get_menu_by_class(self, menuclass, list=None):
         '''
         Returns a loaded menu instance matching the provided class.
         '''
-        list = list or self.menu_instances
-        for item in self.menu_instances:
+        if list is None or list is self.menu_registry:
+            return self.menu_registry.get_by_class(menuclass)
+        for item in list:
             if item.__class__ == menuclass:
                 return item
         return None
@@ -231,7 +464,11 @@ class BaseEnv():
         return '\n'.join(diff)
 
     def get_menu_by_name(self, name, list=None):
-        list = list or self.menu_instances
+        '''
+        Returns a loaded menu instance matching the provided name.
+        '''
+        if list is None or list is self.menu_registry:
+            return self.menu_registry.get_by_name(name)
         for menu in list:
             if menu.name == name:
                 return menu
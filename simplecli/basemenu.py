@@ -4,20 +4,17 @@ import sys
 from cmd import Cmd
 from traceback import print_exc
 from simplecli.baseenv import BaseEnv
+from simplecli.plugins import PluginMenu
+from simplecli.completion import CompletionTrie
+from simplecli.batch import BatchOutput, BatchResult, format_batch_summary
+from simplecli.jobs import current_job
+from simplecli.table import TableFormat
+from simplecli.tracing import get_level as get_trace_level
 from collections import OrderedDict
 import signal
 import time
 from inspect import isclass
-import termios
-import tty
 import re
-import readline
-
-
-try:
-    from colorama import init, Fore, Back
-except ImportError:
-    pass
 
 class CliError(Exception):
     def __init__(self, value):
@@ -26,6 +23,74 @@ class CliError(Exception):
     def __str__(self):
         return repr(self.value)
 
+def get_doc_summary(doc):
+    '''
+    Returns the first line of a command's doc string for use in summaries.
+    '''
+    doc = str(doc).strip()
+    if not doc:
+        return ''
+    return doc.splitlines()[0].strip()
+
+
+class CommandTable(object):
+    '''
+    Table of a menu class's attribute names, and its 'do_', 'complete_',
+    'help_' and 'show_' methods. Commands and show methods are mapped to the
+    first line of their doc strings.
+    Tables are compiled once per menu class by MenuMeta.
+    '''
+    def __init__(self, menuclass):
+        self.names = dir(menuclass)
+        self.commands = OrderedDict()
+        self.completers = set()
+        self.helpers = set()
+        self.shows = OrderedDict()
+        for name in self.names:
+            if name.startswith('do_'):
+                self.commands[name[3:]] = \
+                    get_doc_summary(getattr(menuclass, name).__doc__)
+            elif name.startswith('complete_'):
+                self.completers.add(name[9:])
+            elif name.startswith('help_'):
+                self.helpers.add(name[5:])
+            elif name.startswith('show_'):
+                self.shows[name[5:]] = \
+                    get_doc_summary(getattr(menuclass, name).__doc__)
+        self.show_trie = CompletionTrie(self.shows)
+
+
+class MenuMeta(type):
+    '''
+    Metaclass for BaseMenu. Compiles each menu class's CommandTable when the
+    class is defined, and recompiles it (and those of its subclasses) if
+    command methods are later added to or removed from the class.
+    '''
+    _command_prefixes = ('do_', 'complete_', 'help_', 'show_')
+
+    def __init__(cls, name, bases, attrs):
+        super(MenuMeta, cls).__init__(name, bases, attrs)
+        type.__setattr__(cls, '_command_table', CommandTable(cls))
+
+    def __setattr__(cls, name, value):
+        super(MenuMeta, cls).__setattr__(name, value)
+        if name.startswith(MenuMeta._command_prefixes):
+            cls._recompile_commands()
+
+    def __delattr__(cls, name):
+        super(MenuMeta, cls).__delattr__(name)
+        if name.startswith(MenuMeta._command_prefixes):
+            cls._recompile_commands()
+
+    def _recompile_commands(cls):
+        menuclasses = [cls]
+        while menuclasses:
+            menuclass = menuclasses.pop()
+            type.__setattr__(menuclass, '_command_table',
+                             CommandTable(menuclass))
+            menuclasses.extend(menuclass.__subclasses__())
+
+
 class BaseMenu(Cmd, object):
 
     #########################################################################
@@ -36,6 +101,8 @@ class BaseMenu(Cmd, object):
     # to add the menu to the parent menu(s) as a child/sub menu             #
     #########################################################################
 
+    __metaclass__ = MenuMeta
+
     # This must be defined for subclasses of BaseMenu
     name = None
 
@@ -69,29 +136,37 @@ class BaseMenu(Cmd, object):
         # Note super does not work as Cmd() is an 'old style' class which
         # does not inherit from object(). Instead call init directly.
         self._last_keyboard_interupt = 0
-        signal.signal(signal.SIGINT, self._keyboard_interupt_handler)
-        if 'colorama' in sys.modules:
-            init()
-        self.stdout = stdout or env.default_output or sys.stdout
+        # Sub menus added to this menu instance, name: (menu, description)
+        self._submenu_items = OrderedDict()
+        self._submenu_version = 0
+        # env.plugin_version when the sub menus were last initialized
+        self._submenus_version = None
+        self._command_trie = None
+        self._command_trie_key = None
+        if env.interactive:
+            signal.signal(signal.SIGINT, self._keyboard_interupt_handler)
+            try:
+                from colorama import init
+                init()
+            except ImportError:
+                pass
+        # Output is buffered, and flushed at the end of each command and
+        # before reading input, see BaseEnv.get_output()
+        self.stdout = env.get_output(stdout or env.default_output or
+                                     sys.stdout)
         self.stdin = stdin or env.default_input or sys.stdin
-
-        # Attempt to populate the command history from history file,
-        # if it has not yet, and the file is provided and exists
-        try:
-            history_len = readline.get_history_length()
-            if history_len < 1:
-                history_path = getattr(env.simplecli_config, 'history_file', None)
-                if history_path and os.path.exists(history_path):
-                    readline.read_history_file(history_path)
-        except ImportError as IE:
-            self.eprint('Failed to read in history file, err:{0}'.format(IE))
-            pass
-        Cmd.__init__(self, completekey='tab', stdin=stdin, stdout=stdout)
-        self.stderr = stderr or env.default_error or sys.stderr
+        self.stderr = env.get_output(stderr or env.default_error or
+                                     sys.stderr)
+        if env.interactive:
+            self._read_history(env)
+        Cmd.__init__(self, completekey='tab', stdin=self.stdin,
+                     stdout=self.stdout)
         if not self.name:
             raise ValueError('Class must define "name", extend BaseEnv')
         assert isinstance(env, BaseEnv), "env variable must be of type BaseEnv"
         self.env = env
+        # Debug tracing, see simplecli.tracing
+        self.tracer = env.tracer
         self.prompt_method = prompt_method or env.simplecli_config.prompt_method
         self.path_delimeter = path_delimeter or env.simplecli_config.path_delimeter
         self._path_from_home = []
@@ -100,6 +175,21 @@ class BaseMenu(Cmd, object):
         self._init_submenus()
         self._add_sub_menu(Config_Menu, 'CLI configuration utilities')
 
+    def _read_history(self, env):
+        '''
+        Attempts to populate the command history from history file,
+        if it has not yet, and the file is provided and exists
+        '''
+        try:
+            import readline
+            history_len = readline.get_history_length()
+            if history_len < 1:
+                history_path = getattr(env.simplecli_config, 'history_file', None)
+                if history_path and os.path.exists(history_path):
+                    readline.read_history_file(history_path)
+        except ImportError as IE:
+            self.eprint('Failed to read in history file, err:{0}'.format(IE))
+
     def _setup(self):
         """
         Implement this method to run custom checks and setup in __init__().
@@ -112,6 +202,7 @@ class BaseMenu(Cmd, object):
         current_time = time.time()
         if (current_time - self._last_keyboard_interupt ) <= 1:
             self.do_quit(None, force=True)
+            self.env.flush_output()
             os._exit(0)
         else:
             # Set time of event and raise EOF to clear command line
@@ -172,6 +263,7 @@ class BaseMenu(Cmd, object):
     def _color(self, buf, color='BLUE'):
         color = str(color).upper()
         if 'colorama' in sys.modules:
+            Fore = sys.modules['colorama'].Fore
             color = getattr(Fore, color, "")
             if not color:
                 return buf
@@ -184,18 +276,9 @@ class BaseMenu(Cmd, object):
 
     def _get_terminal_size(self):
         '''
-        Attempts to get terminal size. Currently only Linux.
-        returns (height, width)
+        Returns the terminal size as (height, width), see BaseEnv.terminal
         '''
-        try:
-            # todo Add Windows support
-            import fcntl
-            import struct
-            return struct.unpack('hh', fcntl.ioctl(self.stdout,
-                                                   termios.TIOCGWINSZ,
-                                                   '1234'))
-        except:
-            return 80
+        return self.env.terminal.size
 
     def _init_plugin_menus(self):
         plugins = self.env._get_plugins_for_parent(self.name)
@@ -209,16 +292,61 @@ class BaseMenu(Cmd, object):
         return line
 
     def default(self, args):
+        # A lone '?' is parsed as a request for the menu summary, see
+        # parseline()
+        if self.parseline(args)[0] == 'menu_summary':
+            return self.menu_summary(args)
+        self._set_last_error(CliError('Command or syntax not recognized: '
+                                      '"{0}"'.format(args)))
         self.eprint('Command or syntax not recognized: "{0}"'.format(args))
         return self.menu_summary(args)
 
+    def __getattr__(self, name):
+        # Provide the 'do_' and 'complete_' methods for sub menus added
+        # to this instance, see _add_sub_menu()
+        submenus = self.__dict__.get('_submenu_items')
+        if submenus:
+            if name.startswith('do_') and name[3:] in submenus:
+                return self._get_submenu_do_method(*submenus[name[3:]])
+            if name.startswith('complete_') and name[9:] in submenus:
+                return self._get_submenu_complete_method(
+                    submenus[name[9:]][0])
+        raise AttributeError("'{0}' object has no attribute '{1}'"
+                             .format(self.__class__.__name__, name))
+
     def get_names(self):
-        names = dir(self.__class__)
-        for key in self.__dict__:
-            if not key in names:
-                names.append(key)
+        names = list(self._command_table.names)
+        for name in self._submenu_items:
+            for method_name in ['do_' + name, 'complete_' + name]:
+                if method_name not in names:
+                    names.append(method_name)
         return names
 
+    def get_command_trie(self):
+        '''
+        Returns the CompletionTrie of commands available in this menu,
+        including sub menus. The trie is rebuilt only when the class's
+        command table or this menu's sub menus have changed.
+        '''
+        key = (self._command_table, self._submenu_version)
+        if self._command_trie is None or self._command_trie_key != key:
+            self._command_trie = CompletionTrie(
+                list(self._command_table.commands) +
+                list(self._submenu_items))
+            self._command_trie_key = key
+        return self._command_trie
+
+    def get_command_names(self):
+        '''
+        Returns a sorted list of the commands available in this menu,
+        including sub menus.
+        '''
+        return list(self.get_command_trie().words)
+
+    def completenames(self, text, *ignored):
+        return self.get_command_trie().matches(
+            text, limit=self.env.simplecli_config.max_completions)
+
     def _add_doc_string(value):
         def _doc(func):
             func.__doc__ = value
@@ -233,37 +361,50 @@ class BaseMenu(Cmd, object):
 
 
     def _add_sub_menu(self, menu, description=None):
-        assert isinstance(menu, BaseMenu) or issubclass(menu, BaseMenu), \
+        assert (isinstance(menu, (BaseMenu, PluginMenu)) or
+                issubclass(menu, BaseMenu)), \
             'Error adding sub menu, item is not BaseMenu type'
-        # Add a local method/cli visible command to load
-        # the submenu menu based on the menu name
-        method_name = 'do_' + menu.name
+        # Add a cli visible command to load the submenu menu based on the
+        # menu name. The 'do_' and 'complete_' methods for the submenu are
+        # provided by __getattr__()
+        if self._submenu_items.get(menu.name) != (menu, description):
+            self._submenu_items[menu.name] = (menu, description)
+            self._submenu_version += 1
+
+    def _get_submenu_do_method(self, menu, description=None):
         do_method = lambda line: self._sub_menu_handler(menu, line)
-        setattr(self, method_name, do_method)
-        new_method = getattr(self, method_name)
-        new_method.__doc__ = description or menu._summary or ""
-        new_method.__submenu__ = True
-        # Add completer method to handle presenting the sub-contexts of each
+        do_method.__doc__ = description or menu._summary or ""
+        do_method.__submenu__ = True
+        return do_method
+
+    def _get_submenu_complete_method(self, menu):
+        # Completer method to handle presenting the sub-contexts of each
         # Sub menu based on the completion strings
-        complete_method_name = 'complete_' + menu.name
-        complete_method = \
-            lambda text, line, begidx, endidx: self._sub_menu_complete(text,
-                                                                       menu,
-                                                                       line,
-                                                                       begidx,
-                                                                       endidx)
-        setattr(self, complete_method_name, complete_method)
+        return lambda text, line, begidx, endidx: \
+            self._sub_menu_complete(text, menu, line, begidx, endidx)
 
 
     def _init_submenus(self, menus=None):
-        # Get the menus defined for this menu class
-        menus = menus or self._submenus or []
-        # Get the dynamic submenus/plugins for this menu class
-        menus.extend(self.env._get_plugins_for_parent(self))
+        '''
+        Adds sub menus to this menu. If 'menus' is not provided, the menus
+        defined in this menu class's _submenus along with any plugin menus
+        for this menu are added. This is only done again if plugin menus have
+        been added to the env since the last call.
+        '''
+        if not menus:
+            plugin_version = self.env.plugin_version
+            if self._submenus_version == plugin_version:
+                return
+            # Get the menus defined for this menu class
+            menus = list(self._submenus or [])
+            # Get the dynamic submenus/plugins for this menu class
+            menus.extend(self.env._get_plugins_for_parent(self))
+            self._submenus_version = plugin_version
         # Add each submenu to this menu instance
         for menu in menus:
             try:
-                if isinstance(menu, BaseMenu) or issubclass(menu, BaseMenu):
+                if (isinstance(menu, (BaseMenu, PluginMenu)) or
+                        issubclass(menu, BaseMenu)):
                     self._add_sub_menu(menu)
                 else:
                     raise AttributeError('Init sub-menu error, item must be '
@@ -271,12 +412,9 @@ class BaseMenu(Cmd, object):
             except Exception as ME:
                 if self.env.simplecli_config.debug:
                     print_exc(file=self.stderr)
-                mname = str(menu)
-                self.dprint('Error loading submenu "{0}", err:{1}\n'
-                            .format(mname,
-                                    str(ME)))
-
-
+                self.tracer.plugins.warning(
+                    '{0}: Error loading submenu "{1}", err:{2}',
+                    self.name, menu, ME)
 
     def _sub_menu_handler(self, menu, line):
         '''
@@ -284,8 +422,11 @@ class BaseMenu(Cmd, object):
         menu context should be loaded, or if a command in the chain of
         submenus should be instead executed.
         '''
-        self.dprint('\n submenu_handler. menu:{0}, line:"{1}"'
-                    .format(menu.name, line))
+        self.tracer.dispatch.debug('{0}: submenu_handler. menu:{1}, '
+                                   'line:"{2}"', self.name, menu.name, line)
+        if isinstance(menu, PluginMenu):
+            # Import and create the plugin menu upon first use
+            menu = menu.menu
         if not line:
             return self._load_menu(menu)
         else:
@@ -301,8 +442,9 @@ class BaseMenu(Cmd, object):
                     menu = menuclass(self.env)
                     self.env.menu_instances.append(menu)
                 assert isinstance(menu, BaseMenu)
-                self.dprint('Running cmd:"{0}" , with menu:{1}'
-                            .format(line, menu.name))
+                self.tracer.dispatch.debug('{0}: Running cmd:"{1}", with '
+                                           'menu:{2}', self.name, line,
+                                           menu.name)
                 cmd_attr = getattr(menu, 'do_' + line, None)
                 # If a new submenu is being loaded, update the prompts path
                 if cmd_attr and hasattr(cmd_attr,'__submenu__'):
@@ -318,9 +460,13 @@ class BaseMenu(Cmd, object):
         complete and see the items in the chain of submenus.
         '''
 
-        self.dprint('sub_menu_complete(). self:{0}, menu:{1}, text:"{2}", '
-                    'line:"{3}"'.format(self.name, menu.name, text, line))
+        trace = self.tracer.completion
+        trace.debug('{0}: sub_menu_complete(). menu:{1}, text:"{2}", '
+                    'line:"{3}"', self.name, menu.name, text, line)
         ret = []
+        if isinstance(menu, PluginMenu):
+            # Import and create the plugin menu upon first use
+            menu = menu.menu
         if isinstance(menu, BaseMenu):
             menuclass = menu.__class__
         elif isclass(menu):
@@ -333,16 +479,18 @@ class BaseMenu(Cmd, object):
                 menu = menuclass(self.env)
                 self.env.menu_instances.append(menu)
             assert isinstance(menu, BaseMenu)
-            self.dprint('sub_menu_complete() getting menu items from '
-                        '{0}.completeddefault()'.format(menu.name))
+            trace.debug('{0}: sub_menu_complete() getting menu items from '
+                        '{1}.completedefault()', self.name, menu.name)
             menu_items = menu.completedefault(text, line, begidx, endidx)
+            base_commands = BaseMenu._command_table.commands
             for item in menu_items:
-                if not hasattr(BaseMenu, 'do_' + item.strip()):
+                if item.strip() not in base_commands:
                     ret.append(item)
         except:
             print_exc()
             raise
-        self.dprint('sub_menu_complete() returning menu items:' + str(ret))
+        trace.debug('{0}: sub_menu_complete() returning menu items:{1}',
+                    self.name, ret)
         return ret
 
     def complete(self, text, state):
@@ -350,8 +498,9 @@ class BaseMenu(Cmd, object):
         If a command has not been entered, then complete against command list.
         Otherwise try to call complete_<command> to get list of completions.
         """
-        self.dprint('Complete()1: menu:"{0}", text:"{1}", state:"{2}"'
-                    .format(self.name, text, state))
+        trace = self.tracer.completion
+        trace.debug('{0}: complete() text:"{1}", state:"{2}"',
+                    self.name, text, state)
         if state == 0:
             import readline
             origline = readline.get_line_buffer()
@@ -359,24 +508,27 @@ class BaseMenu(Cmd, object):
             stripped = len(origline) - len(line)
             begidx = readline.get_begidx() - stripped
             endidx = readline.get_endidx() - stripped
-            self.dprint('Complete()2: text:{0}, origline:{1}'.format(text, line))
+            trace.debug('{0}: complete() text:{1}, origline:{2}',
+                        self.name, text, line)
             if begidx>=0:
                 cmd, args, foo = self.parseline(line)
                 if not cmd:
-                    self.dprint('Complete()3: no cmd after parseline(), '
-                                'sending to default()')
+                    trace.debug('{0}: complete() no cmd after parseline(), '
+                                'sending to completedefault()', self.name)
                     compfunc = self.completedefault
                 else:
                     try:
                         compfunc = getattr(self, 'complete_' + cmd)
-                        self.dprint('Complete()4: got method complete_' + str(cmd))
+                        trace.debug('{0}: complete() got method complete_{1}',
+                                    self.name, cmd)
                     except AttributeError:
-                        self.dprint('Complete()5: no complete_ method '
-                                    'found, sending to default()')
+                        trace.debug('{0}: complete() no complete_ method '
+                                    'found, sending to completedefault()',
+                                    self.name)
                         compfunc = self.completedefault
             else:
-                self.dprint('Complete()2: non-zero state sending to '
-                            'completenames(), state:{0}'.format(state))
+                trace.debug('{0}: complete() non-zero state sending to '
+                            'completenames(), state:{1}', self.name, state)
                 compfunc = self.completenames
             try:
                 self.completion_matches = compfunc(text, line, begidx, endidx)
@@ -394,9 +546,9 @@ class BaseMenu(Cmd, object):
         local complete ('complete_') or execute('do_') methods to be used
         in the chain of submenu contexts
         '''
-        self.dprint('default(). menu:{0}, text:{1}, line:"{2}", '
-                    'beg:{3}, end{4}'
-                    .format(self.name, text, line, begidx, endidx ))
+        trace = self.tracer.completion
+        trace.debug('{0}: completedefault() text:{1}, line:"{2}", beg:{3}, '
+                    'end:{4}', self.name, text, line, begidx, endidx)
         # See if this is in the process of completing a word or line
         if not text and begidx is not None and endidx is not None:
             if begidx == endidx:
@@ -404,10 +556,9 @@ class BaseMenu(Cmd, object):
         text = (text or '').lstrip()
         # See if this is being handled by a submenu and the local menu name
         # needs to be removed...
-        self.dprint('default(). Looking regex: re.search("^{0}\s*$", {1})'
-                    .format(self.name, text))
         text = re.sub('^' + self.name + '\s*', '', text)
-        self.dprint('default() text after replace:"{0}"'.format(text))
+        trace.debug('{0}: completedefault() text after removing menu '
+                    'name:"{1}"', self.name, text)
         line = text
         # See if theres a 'complete_' method local to this menu based on the
         # first word in the line, if not return all the matching
@@ -416,7 +567,8 @@ class BaseMenu(Cmd, object):
         # the chain of submenus to return available matching methods.
         try:
             firstword = str(text).split()[0]
-            self.dprint('default() got first word:' + str(firstword))
+            trace.debug('{0}: completedefault() got first word:{1}',
+                        self.name, firstword)
         except IndexError:
             firstword = None
         if firstword:
@@ -429,10 +581,11 @@ class BaseMenu(Cmd, object):
                 except:
                     print_exc()
                     raise
-        self.dprint('default() returning {0}.get_names() for matching:{1}'
-                    .format(self.name, 'do_'+ str(text)))
-        dotext = 'do_' + str(text)
-        return [a[3:] + " " for a in self.get_names() if a.startswith(dotext)]
+        trace.debug('{0}: completedefault() returning command names '
+                    'matching:{1}', self.name, text)
+        matches = self.get_command_trie().matches(
+            str(text), limit=self.env.simplecli_config.max_completions)
+        return [name + " " for name in matches]
 
 
     def oprint(self, buf, allow_break=True):
@@ -440,65 +593,135 @@ class BaseMenu(Cmd, object):
         Helper function to print to the output (ie stdout) specififed
         If page_break is set, this will also provide user interactive
         scrolling based on the terminal size.
+        'buf' may also be an iterable of strings, see ostream().
+        Output is buffered until the end of the command, use flush() to
+        write it out sooner.
+        '''
+        if not isinstance(buf, basestring) and hasattr(buf, '__iter__'):
+            return self.ostream(buf, allow_break=allow_break)
+        if self._page_output(allow_break):
+            return self.ostream([buf], allow_break=allow_break)
+        self.stdout.write(str(buf).rstrip("\n") + "\n")
+
+    def flush(self):
+        '''
+        Writes out this menu's buffered output, ie to show progress during a
+        long running command.
+        '''
+        self.stdout.flush()
+        self.stderr.flush()
+
+    def _page_output(self, allow_break=True):
+        return (allow_break and self.env.simplecli_config.page_break and
+                current_job() is None and self.env.terminal.is_terminal)
+
+    def ostream(self, bufs, allow_break=True):
+        '''
+        Prints each string read from the iterable 'bufs' as it is read, ie
+        from a generator producing the output of a long listing.
+        If page_break is set, output is paged based on the terminal size,
+        and 'bufs' is only read as far as the current page. If the user quits
+        the pager 'bufs' is closed, which stops a generator producing it.
+        Returns False if the user quit the pager, otherwise True.
         '''
-        if allow_break and self.env.simplecli_config.page_break:
-            height, width = self._get_terminal_size()
-            lines = buf.splitlines()
-            x = 0
-            y = 0
-            length = height
-            line_cnt = len(lines)
-            while y < line_cnt:
-                length = length or line_cnt
-                y += length
-                if y >= line_cnt:
-                    y = line_cnt
-                for line in lines[x:y]:
-                    self.stdout.write(str(line) + "\n")
+        if not self._page_output(allow_break):
+            for buf in bufs:
+                self.stdout.write(str(buf).rstrip("\n") + "\n")
+            return True
+        height, width = self._get_terminal_size()
+        # Leave a line for the pager prompt
+        height = max(height - 1, 1)
+        lines = (line for buf in bufs for line in str(buf).splitlines())
+        length = height
+        # Terminal settings, read once when first needed
+        settings = {}
+        line = next(lines, None)
+        while line is not None:
+            count = 0
+            while line is not None and (not length or count < length):
+                self.stdout.write(line + "\n")
+                count += 1
+                line = next(lines, None)
+            self.stdout.flush()
+            if line is None:
+                break
+            #Handle the 'more' type scrolling function...
+            self.stdout.write(':\r')
+            self.stdout.flush()
+            ch = str(self._read_page_key(settings))
+            self.stdout.write('\b')
+            if ch == "\n" or ch == "\r" or ch == "":
+                length = height
+            elif ch == "a":
+                length = 0
+            elif ch == "q":
+                self.stdout.write('\n')
                 self.stdout.flush()
-                x = y
-                if (y + 1) >= line_cnt:
-                    return
-                else:
-                    #Handle the 'more' type scrolling function...
-                    self.stdout.write(':\r')
-                    self.stdout.flush()
-                    fd = self.stdin.fileno()
-                    old_settings = termios.tcgetattr(fd)
-                    try:
-                        tty.setraw(sys.stdin.fileno())
-                        ch = sys.stdin.read(1)
-                    finally:
-                        termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-                    #print '\b ',
-                    self.stdout.write('\b')
-                    ch = str(ch)
-                    if ch == "\n" or ch == "\r" or ch == "":
-                        length = height
-                    elif ch == "a":
-                        length = 0
-                    elif ch == "q":
-                        print "\n"
-                        self.stdout.write('\n')
-                        return
-                    else:
-                        length = 1
-                    self.stdout.flush()
+                close = getattr(bufs, 'close', None)
+                if close:
+                    close()
+                return False
+            else:
+                length = 1
+        return True
+
+    def _read_page_key(self, settings):
+        '''
+        Reads a single key press from stdin for the pager. The terminal's
+        settings are read into 'settings' on the first call, and reused for
+        later calls.
+        '''
+        import termios
+        import tty
+        if not settings:
+            settings['fd'] = self.stdin.fileno()
+            settings['old'] = termios.tcgetattr(settings['fd'])
+            tty.setraw(settings['fd'])
+            settings['raw'] = termios.tcgetattr(settings['fd'])
         else:
-            self.stdout.write(str(buf).rstrip("\n") + "\n")
-            self.stdout.flush()
+            termios.tcsetattr(settings['fd'], termios.TCSANOW, settings['raw'])
+        try:
+            return os.read(settings['fd'], 1)
+        finally:
+            termios.tcsetattr(settings['fd'], termios.TCSADRAIN,
+                              settings['old'])
+
+    def get_table_format(self, header=None, align=None, hlines=True):
+        '''
+        Returns a new TableFormat (see simplecli.table) for tables with
+        'header' and 'align'. Use the same format for the tables of one
+        listing, so they are drawn at the same widths without measuring
+        earlier tables again. Column widths only grow, so get a new format
+        for each listing.
+        When output is to a terminal, tables are fit to its width.
+        '''
+        max_width = None
+        terminal = self.env.terminal
+        if terminal.is_terminal:
+            max_width = terminal.width
+        return TableFormat(header=header, align=align, hlines=hlines,
+                           max_width=max_width)
+
+    def draw_table(self, rows, header=None, align=None, hlines=True):
+        '''
+        Returns 'rows', a list of lists of values, drawn as a text table.
+        :param header: optional list of column headers
+        :param align: optional list of 'l', 'r' or 'c' per column
+        :param hlines: boolean, draw a line between rows
+        '''
+        table_format = self.get_table_format(header=header, align=align,
+                                             hlines=hlines)
+        return table_format.draw(rows)
 
     def eprint(self, buf):
         buf = self._color(buf=str(buf), color='RED')
         self.stderr.write(str(buf).rstrip("\n") + "\n")
-        self.stderr.flush()
 
     def dprint(self, buf):
         if self.debug:
             buf = self.name + ": " + str(buf)
             buf = self._color(buf=str(buf), color='YELLOW')
             self.stderr.write(str(buf).rstrip("\n") + "\n")
-            self.stderr.flush()
 
     def do_output_test(self, args):
         """
@@ -532,19 +755,49 @@ class BaseMenu(Cmd, object):
             self._load_menu(self.path_from_home[0],
                             path_from_home=[])
 
+    def _set_last_error(self, error):
+        '''
+        Records an error caught while running a command, on the background
+        job if run in one, otherwise as the env's last_error.
+        '''
+        job = current_job()
+        if job is not None:
+            job.error = error
+        else:
+            self.env.last_error = error
+
     def onecmd(self, line):
+        # A trailing '&' runs the command as a background job
+        stripped = str(line).rstrip()
+        if (stripped.endswith('&') and len(stripped) > 1 and
+                current_job() is None):
+            job = self.env.jobs.start(self, stripped[:-1].rstrip())
+            self.oprint('[{0}] started: {1}'.format(job.id, job.line))
+            return
+        self.tracer.dispatch.debug('{0}: onecmd "{1}"', self.name, line)
         try:
+            profiler = self.env.profiler
+            if profiler.enabled:
+                name = '{0}.{1}'.format(self.name,
+                                        self.parseline(line)[0] or line)
+                return profiler.runcall(name, Cmd.onecmd, self, line)
             return Cmd.onecmd(self, line)
         except CliError as AE:
+            self._set_last_error(AE)
             self.eprint("ERROR: " + str(AE))
             return self.onecmd("? " + str(line))
         except SystemExit:
             raise
         except Exception as FE:
+            self._set_last_error(FE)
             if self.env.simplecli_config.debug:
                 print_exc(file=self.stderr)
             self.eprint('\n"{0}", err:{1}'.format(line, str(FE)))
             self.oprint('\n')
+        finally:
+            # Background jobs' output is collected, not buffered
+            if current_job() is None:
+                self.env.flush_output()
 
     def do_back(self, args):
         """Go Back one level in menu tree"""
@@ -555,6 +808,13 @@ class BaseMenu(Cmd, object):
                             path_from_home=self.path_from_home)
 
     def _load_menu(self, menu, path_from_home=None):
+        '''
+        Makes 'menu' the active menu. If the cli's input loop is running,
+        the loop switches to reading commands for 'menu' once the current
+        command returns, otherwise the input loop is started with 'menu'.
+        '''
+        if current_job() is not None:
+            raise CliError('Menus can not be loaded from a background job')
         if path_from_home is None:
             path_from_home = self.path_from_home
         if isinstance(menu, BaseMenu):
@@ -578,11 +838,259 @@ class BaseMenu(Cmd, object):
         else:
             raise TypeError('Menu must of type BaseMenu, menu:{0}, type:{1}'
                             .format(str(menu), type(menu)))
-        self = menu
-        self.cmdloop(intro=self.intro)
-        self.oprint(self._color('BLUE') + "**** {0} MENU ****"
-                    .format(str(self.name)) + "\n")
+        if self.env.active_menu is None:
+            return menu.cmdloop(intro=menu.intro)
+        self.env.active_menu = menu
+        if menu.intro:
+            menu.stdout.write(str(menu.intro) + "\n")
 
+    def _complete_active_menu(self, text, state):
+        '''
+        Readline completer used by cmdloop(), forwards to the active menu.
+        '''
+        menu = self.env.active_menu or self
+        return menu.complete(text, state)
+
+    def cmdloop(self, intro=None):
+        """
+        Runs the cli's input loop starting with this menu.
+        A single loop is run for the cli. Menus loaded with _load_menu()
+        (ie sub menus, back and home) become the env's active_menu, and the
+        loop reads and dispatches the next command with the active menu.
+        The path to the active menu is kept in its path_from_home list.
+        """
+        if self.env.active_menu is not None:
+            # The loop is already running, switch to this menu instead
+            self.env.active_menu = self
+            return
+        self.env.active_menu = self
+        self.preloop()
+        if self.use_rawinput and self.completekey:
+            try:
+                import readline
+                self.old_completer = readline.get_completer()
+                readline.set_completer(self._complete_active_menu)
+                readline.parse_and_bind(self.completekey + ": complete")
+            except ImportError:
+                pass
+        try:
+            if intro is not None:
+                self.intro = intro
+            if self.intro:
+                self.stdout.write(str(self.intro) + "\n")
+            stop = None
+            while not stop:
+                menu = self.env.active_menu
+                menu._report_jobs()
+                if menu.cmdqueue:
+                    line = menu.cmdqueue.pop(0)
+                elif menu.use_rawinput:
+                    self.env.flush_output()
+                    try:
+                        line = raw_input(menu.prompt)
+                    except EOFError:
+                        line = 'EOF'
+                else:
+                    menu.stdout.write(menu.prompt)
+                    menu.stdout.flush()
+                    line = menu.stdin.readline()
+                    if not len(line):
+                        line = 'EOF'
+                    else:
+                        line = line.rstrip('\r\n')
+                line = menu.precmd(line)
+                stop = menu.onecmd(line)
+                stop = menu.postcmd(stop, line)
+            self.env.active_menu.postloop()
+        finally:
+            self.env.active_menu = None
+            if self.use_rawinput and self.completekey:
+                try:
+                    import readline
+                    readline.set_completer(self.old_completer)
+                except ImportError:
+                    pass
+
+
+    def run_script(self, script, stop_on_error=None, output=None,
+                   summary=True):
+        '''
+        Runs the commands in 'script' without prompting or paging, starting
+        with this menu. Commands which load menus (sub menus, back, home)
+        change the menu following commands are run with.
+        Output is buffered and written out in chunks.
+        :param script: path to a script file, or an iterable of lines
+        :param stop_on_error: boolean, stop running the script after a failed
+                              command. Defaults to the 'batch_stop_on_error'
+                              config value.
+        :param output: file like obj to write output to, defaults to stdout
+        :param summary: boolean, print a status and timing summary at the end
+        returns a list of BatchResult, one per command run
+        '''
+        config = self.env.simplecli_config
+        if stop_on_error is None:
+            stop_on_error = config.batch_stop_on_error
+        script_file = None
+        if isinstance(script, basestring):
+            script_file = open(script, 'r')
+            script = script_file
+        stream = BatchOutput(output or self.stdout)
+        saved_stdout = [(menu, menu.stdout)
+                        for menu in set([self] + list(self.env.menu_instances))]
+        saved_default_output = self.env.default_output
+        saved_page_break = config.page_break
+        saved_active_menu = self.env.active_menu
+        for menu, menu_stdout in saved_stdout:
+            menu.stdout = stream
+        self.env.default_output = stream
+        config.page_break = False
+        self.env.active_menu = self
+        results = []
+        try:
+            for line_no, line in enumerate(script, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                menu = self.env.active_menu
+                if menu.stdout is not stream:
+                    saved_stdout.append((menu, menu.stdout))
+                    menu.stdout = stream
+                path = menu.path
+                status = 'ok'
+                self.env.last_error = None
+                start = time.time()
+                try:
+                    line = menu.precmd(line)
+                    stop = menu.onecmd(line)
+                    stop = menu.postcmd(stop, line)
+                except SystemExit:
+                    stop = True
+                    status = 'quit'
+                elapsed = time.time() - start
+                error = self.env.last_error
+                if error is not None:
+                    status = 'error'
+                results.append(BatchResult(line_no=line_no,
+                                           line=line,
+                                           path=path,
+                                           status=status,
+                                           elapsed=elapsed,
+                                           error=error))
+                if stop or (error is not None and stop_on_error):
+                    break
+            if summary and results:
+                stream.write(format_batch_summary(results))
+        finally:
+            if script_file:
+                script_file.close()
+            for menu, menu_stdout in saved_stdout:
+                menu.stdout = menu_stdout
+            # Menus created during the run were given the batch output
+            for menu in self.env.menu_instances:
+                if menu.stdout is stream:
+                    menu.stdout = self.env.get_output(saved_default_output)
+            self.env.default_output = saved_default_output
+            config.page_break = saved_page_break
+            self.env.active_menu = saved_active_menu
+            stream.drain()
+        return results
+
+    def do_run_script(self, args):
+        """
+        Runs the commands in a script file, starting with this menu.
+
+        Usage: run_script <file path> (optional: stop_on_error)
+        """
+        args = str(args).split()
+        if not args:
+            raise CliError('Script file path required')
+        stop_on_error = None
+        if len(args) > 1:
+            stop_on_error = args[1].lower() == 'stop_on_error'
+        self.run_script(args[0], stop_on_error=stop_on_error)
+
+    def _report_jobs(self):
+        '''
+        Prints a notice for each background job finished since last called.
+        '''
+        for job in self.env.jobs.get_finished_unreported():
+            self.oprint('[{0}] {1}: {2}  (use "wait {0}" for output)'
+                        .format(job.id, job.status, job.line),
+                        allow_break=False)
+
+    @property
+    def stdout(self):
+        # Output from a background job is collected in the job's output
+        job = current_job()
+        if job is not None:
+            return job.output
+        return self._stdout
+
+    @stdout.setter
+    def stdout(self, stdout):
+        self._stdout = stdout
+
+    @property
+    def stderr(self):
+        job = current_job()
+        if job is not None:
+            return job.output
+        return self._stderr
+
+    @stderr.setter
+    def stderr(self, stderr):
+        self._stderr = stderr
+
+    def do_jobs(self, args):
+        """
+        Lists background jobs. Run a command in the background by ending it
+        with '&'.
+        """
+        buf = ""
+        for job in self.env.jobs:
+            buf += '\t[{0}] {1} {2} {3:.1f}s  {4}\n'.format(
+                job.id, job.status.ljust(9), job.menu.name, job.elapsed,
+                job.line)
+        self.oprint(buf or 'No background jobs')
+
+    def do_wait(self, args):
+        """
+        Waits for a background job to finish and prints its output.
+
+        Usage: wait <job id> (optional: timeout seconds)
+        """
+        args = str(args).split()
+        if not args:
+            raise CliError('Job id required')
+        timeout = None
+        if len(args) > 1:
+            timeout = float(args[1])
+        try:
+            job = self.env.jobs.wait(args[0], timeout=timeout)
+        except ValueError as VE:
+            raise CliError(str(VE))
+        if not job.done:
+            self.eprint('Job [{0}] still running after {1}s'
+                        .format(job.id, timeout))
+            return
+        self.oprint('[{0}] {1}: {2}'.format(job.id, job.status, job.line))
+        output = job.output.getvalue()
+        if output:
+            self.oprint(output)
+        if job.error is not None:
+            self.eprint('[{0}] err:{1}'.format(job.id, job.error))
+
+    def do_cancel(self, args):
+        """
+        Cancels a background job and discards its output.
+
+        Usage: cancel <job id>
+        """
+        try:
+            job = self.env.jobs.cancel(str(args).strip())
+        except ValueError as VE:
+            raise CliError(str(VE))
+        self.oprint('[{0}] cancelled: {1}'.format(job.id, job.line))
 
     def do_clear(self, args):
         """
@@ -595,30 +1103,32 @@ class BaseMenu(Cmd, object):
         submenus = ""
         basecommands = ""
         commands = ""
-        prevname = None
-        names = self.get_names()
-        menu_items = []
+        table = self._command_table.commands
+        base_table = BaseMenu._command_table.commands
+        menu_items = self.get_command_names()
         maxlen = 0
-        #Sort out methods that begin with 'do_' as menu items...
-        for name in names:
-            if name[:3] == 'do_':
-                if name == prevname:
-                    continue
-                prevname = name
-                if len(name[3:]) > maxlen:
-                    maxlen = len(name[3:])
-                menu_items.append(name)
+        if menu_items:
+            maxlen = max(len(name) for name in menu_items)
+        # Shorten doc summaries to fit the terminal, each line is a tab
+        # (8 chars), the name, ' --> ' and the quoted summary
+        doclen = None
+        if self.env.terminal.is_terminal:
+            doclen = max(self.env.terminal.width - maxlen - 16, 20)
         #Sort out menu items into: submenus, local commands, and globals
-        for name in menu_items:
-            cmd = str(name[3:])
-            cmd_method = getattr(self, name)
-            doc = str(cmd_method.__doc__) or ''
-            doc = doc.lstrip().splitlines()[0].strip()
-            if hasattr(cmd_method,'__submenu__'):
+        for cmd in menu_items:
+            if cmd in table:
+                doc = table[cmd]
+            else:
+                menu, description = self._submenu_items[cmd]
+                doc = get_doc_summary(description or menu._summary or "")
+            if doclen and len(doc) > doclen:
+                doc = doc[:doclen - 3] + '...'
+            if cmd not in table:
                 submenus += '\t{0} {1} "{2}"'.format(cmd.ljust(maxlen),
                                                      "-->",
                                                      doc) + "\n"
-            elif hasattr(BaseMenu, name):
+                continue
+            if cmd in base_table:
                 basecommands += '\t{0} {1} "{2}"'.format(cmd.ljust(maxlen),
                                                          "-->",
                                                          doc) + "\n"
@@ -727,8 +1237,7 @@ class Config_Menu(BaseMenu):
         return self.help_show()
 
     def help_show(self, *args):
-        match = 'show_'
-        showlist = [a[5:] + " " for a in self.get_names() if a.startswith(match)]
+        showlist = [name + " " for name in self._command_table.shows]
         self.oprint('Available show commands:\n{0}'.format("\n\t".join(showlist)))
 
     def complete_show(self, text, *ignore):
@@ -736,8 +1245,9 @@ class Config_Menu(BaseMenu):
         complete_method = getattr(self, 'show_' + text, None)
         if complete_method:
             return complete_method(text, ignore)
-        match = 'show_' + str(text)
-        return [a[5:] + " " for a in self.get_names() if a.startswith(match)]
+        matches = self._command_table.show_trie.matches(
+            str(text), limit=self.env.simplecli_config.max_completions)
+        return [name + " " for name in matches]
 
     def show_stuff(self, args):
         print 'you got stuff'
@@ -766,7 +1276,91 @@ class Config_Menu(BaseMenu):
             self.env.simplecli_config.debug = True
         else:
             self.env.simplecli_config.debug = False
+        self.env.configure_tracer()
+
+    def do_set_trace(self, args):
+        """
+        Sets the level of debug trace messages, and optionally the categories
+        traced and a file to append them to instead of stderr.
 
+        Usage: set_trace <debug|info|warning|error|off> [categories] [file]
+        categories: comma separated, ie 'completion,dispatch', or 'all'.
+                    Built in categories are: completion, dispatch, plugins,
+                    config
+        """
+        args = str(args).split()
+        if not args:
+            raise CliError('Trace level required')
+        try:
+            get_trace_level(args[0])
+        except ValueError as VE:
+            raise CliError(str(VE))
+        config = self.env.simplecli_config
+        config.trace_level = args[0].lower()
+        config.trace_categories = 'all'
+        if len(args) > 1:
+            config.trace_categories = args[1]
+        config.trace_file = None
+        if len(args) > 2:
+            config.trace_file = os.path.expanduser(args[2])
+        self.env.configure_tracer()
+
+
+    def do_set_profile(self, args):
+        """
+        Enables/disables profiling of the commands run, see show_profile.
+        Usage set_profile [on/off/clear] (optional: dump)
+        on: profile each command. With 'dump', a pstats file per command is
+            also written to the 'profile_dir' config dir for offline use.
+        off: stop profiling, the stats collected so far are kept
+        clear: discard the stats collected so far
+        """
+        args = str(args).lower().split()
+        if not args or args[0] not in ['on', 'off', 'clear']:
+            raise CliError('"{0}", Invalid arg. Use "on/off/clear"'
+                           .format(' '.join(args)))
+        profiler = self.env.profiler
+        if args[0] == 'clear':
+            profiler.clear()
+            return
+        profiler.enabled = args[0] == 'on'
+        profiler.dump_dir = None
+        if profiler.enabled and 'dump' in args[1:]:
+            profiler.dump_dir = self.env.simplecli_config.profile_dir
+            self.oprint('Writing pstats files to: {0}'
+                        .format(profiler.dump_dir))
+
+    def do_show_profile(self, args):
+        """
+        Shows the functions with the most cumulative time for each command
+        profiled, see set_profile.
+        Usage show_profile (optional: N, default 20) (optional: command)
+        N: number of functions shown per command
+        command: only show commands with names containing this, ie
+                 'show_catalog'
+        """
+        args = str(args).split()
+        limit = 20
+        if args and args[0].isdigit():
+            limit = int(args.pop(0))
+        match = None
+        if args:
+            match = args[0]
+        profiles = [profile for profile in self.env.profiler.get_profiles()
+                    if not match or match in profile.name]
+        if not profiles:
+            self.oprint('No profiled commands, see "set_profile"')
+            return
+        for profile in profiles:
+            rows = [['{0:.4f}'.format(cumtime), '{0:.4f}'.format(tottime),
+                     ncalls, function]
+                    for function, ncalls, tottime, cumtime
+                    in profile.get_hotspots(limit=limit)]
+            self.oprint('\n{0}: {1} runs, {2:.3f}s total'
+                        .format(profile.name, profile.runs, profile.elapsed))
+            self.oprint(self.draw_table(
+                rows, header=['CUMTIME', 'TOTTIME', 'NCALLS', 'FUNCTION'],
+                align=['r', 'r', 'r', 'l'], hlines=False))
 
     def do_set_page_break(self, enable):
         """
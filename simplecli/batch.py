@@ -0,0 +1,86 @@
+__author__ = 'clarkmatthew'
+
+from collections import namedtuple, OrderedDict
+
+
+# Result of a single command run by BaseMenu.run_script()
+# status is one of 'ok', 'error' or 'quit'
+BatchResult = namedtuple('BatchResult', ['line_no', 'line', 'path', 'status',
+                                         'elapsed', 'error'])
+
+
+class BatchOutput(object):
+    '''
+    File like wrapper used as menu output while running a batch script.
+    Writes are collected in memory and written to the wrapped stream in
+    chunks of 'buffer_size' bytes. Calls to flush() from the menus' print
+    methods are ignored, use drain() to write out the buffered output.
+    '''
+    def __init__(self, stream, buffer_size=65536):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._buf = []
+        self._buf_len = 0
+
+    def write(self, data):
+        self._buf.append(data)
+        self._buf_len += len(data)
+        if self._buf_len >= self.buffer_size:
+            self.drain()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        return
+
+    def drain(self):
+        if self._buf:
+            self.stream.write(''.join(self._buf))
+            self._buf = []
+            self._buf_len = 0
+        self.stream.flush()
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def isatty(self):
+        return False
+
+
+def format_batch_summary(results):
+    '''
+    Returns a formatted summary of the BatchResults from a batch run, with
+    the count, errors and time taken per command name, followed by the
+    commands which failed.
+    '''
+    commands = OrderedDict()
+    errors = []
+    total_time = 0
+    for result in results:
+        total_time += result.elapsed
+        # Lines may be empty after precmd(), ie 'EOF'
+        name = (result.line.split() or [''])[0]
+        stats = commands.setdefault(name, [0, 0, 0])
+        stats[0] += 1
+        stats[2] += result.elapsed
+        if result.status == 'error':
+            stats[1] += 1
+            errors.append(result)
+    maxlen = max([len('COMMAND')] + [len(name) for name in commands])
+    buf = ('\n*** BATCH SUMMARY ***\n'
+           'commands: {0}, errors: {1}, total time: {2:.3f}s\n\n'
+           .format(len(results), len(errors), total_time))
+    buf += '{0}  {1:>7}  {2:>7}  {3:>10}  {4:>10}\n'.format(
+        'COMMAND'.ljust(maxlen), 'COUNT', 'ERRORS', 'TOTAL(s)', 'AVG(ms)')
+    for name, (count, error_count, elapsed) in commands.iteritems():
+        buf += '{0}  {1:>7}  {2:>7}  {3:>10.3f}  {4:>10.3f}\n'.format(
+            name.ljust(maxlen), count, error_count, elapsed,
+            elapsed * 1000 / count)
+    if errors:
+        buf += '\nERRORS:\n'
+        for result in errors:
+            buf += '\tline {0}: "{1}" ({2}), err:{3}\n'.format(
+                result.line_no, result.line, result.path, result.error)
+    return buf
@@ -0,0 +1,236 @@
+__author__ = 'clarkmatthew'
+
+from collections import Counter
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Column(object):
+    '''
+    The values of attribute 'name' across a list of items.
+    Numeric columns hold floats, with NaN for missing values. Other columns
+    hold unicode strings, with u'' for missing values. List attributes are
+    flattened, and 'rows' holds the position of the item each value came
+    from (None for plain attributes).
+    With NumPy, string columns are stored as integer codes into the sorted
+    array of distinct values 'categories'.
+    '''
+    def __init__(self, name, values, rows=None, numeric=False,
+                 categories=None):
+        self.name = name
+        self.values = values
+        self.rows = rows
+        self.numeric = numeric
+        self.categories = categories
+
+
+class ColumnStore(object):
+    '''
+    Columnar copy of the attributes of a list of items, for computing
+    counts and aggregates without walking the items.
+    Columns are built on first use and kept. Uses NumPy arrays when NumPy
+    is available, otherwise lists.
+    :param items: list of items. Positions refer to this list.
+    :param use_numpy: boolean, defaults to True when NumPy is available
+    '''
+    def __init__(self, items, use_numpy=None):
+        self.items = items
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        self.use_numpy = use_numpy
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.items)
+
+    def get_column(self, name, numeric=None):
+        '''
+        Returns the Column for attribute 'name'.
+        :param numeric: boolean, store the values as floats. By default
+                        values are stored as floats if they all convert.
+        '''
+        key = (name, numeric)
+        column = self._columns.get(key)
+        if column is None:
+            column = self._build_column(name, numeric)
+            self._columns[key] = column
+        return column
+
+    def _build_column(self, name, numeric=None):
+        attr_name = str(name).replace('-', '_')
+        values = [getattr(item, attr_name, None) for item in self.items]
+        rows = None
+        if any(isinstance(value, list) for value in values):
+            # Flatten list values, keeping the position each came from
+            attrs = values
+            values = []
+            rows = []
+            for pos, attr in enumerate(attrs):
+                if not isinstance(attr, list):
+                    attr = [attr]
+                values.extend(attr)
+                rows.extend([pos] * len(attr))
+        if numeric is not False:
+            floats = []
+            try:
+                for value in values:
+                    if value is None or value == '':
+                        floats.append(float('nan'))
+                    else:
+                        floats.append(float(value))
+            except (ValueError, TypeError):
+                if numeric:
+                    raise ValueError('Attribute "{0}" has non numeric values'
+                                     .format(name))
+            else:
+                numeric = True
+                values = floats
+        if numeric is not True:
+            numeric = False
+            values = [self._to_unicode(value) for value in values]
+        categories = None
+        if self.use_numpy:
+            if numeric:
+                values = numpy.array(values, dtype=float)
+            else:
+                categories, values = numpy.unique(
+                    numpy.array(values, dtype=unicode), return_inverse=True)
+            if rows is not None:
+                rows = numpy.array(rows, dtype=int)
+        return Column(name, values, rows=rows, numeric=numeric,
+                      categories=categories)
+
+    @staticmethod
+    def _to_unicode(value):
+        if value is None:
+            return u''
+        if isinstance(value, unicode):
+            return value
+        if isinstance(value, str):
+            return value.decode('utf-8', 'replace')
+        return unicode(value)
+
+    def _select(self, column, positions=None):
+        # Returns the NumPy column values (or codes) of the items at
+        # 'positions', leaving out missing values
+        values = column.values
+        if positions is not None:
+            positions = numpy.asarray(positions, dtype=int)
+            if column.rows is None:
+                values = values[positions]
+            else:
+                values = values[numpy.in1d(column.rows, positions)]
+        if column.numeric:
+            return values[~numpy.isnan(values)]
+        if len(column.categories) and column.categories[0] == u'':
+            # Missing values sort first
+            return values[values != 0]
+        return values
+
+    def get_values(self, name, positions=None, numeric=None):
+        '''
+        Returns the values of attribute 'name' for the items at 'positions',
+        or for all items if positions is None. Missing values are left out.
+        '''
+        column = self.get_column(name, numeric=numeric)
+        if self.use_numpy:
+            values = self._select(column, positions)
+            if column.numeric:
+                return values
+            return column.categories[values]
+        values = column.values
+        if positions is not None:
+            if column.rows is None:
+                values = [values[pos] for pos in positions]
+            else:
+                positions = set(positions)
+                values = [value for value, row in zip(values, column.rows)
+                          if row in positions]
+        if column.numeric:
+            return [value for value in values if value == value]
+        return [value for value in values if value != u'']
+
+    def group_counts(self, name, positions=None, prefix=None):
+        '''
+        Returns a list of (value, count) tuples for attribute 'name', most
+        common first.
+        :param positions: optional list of item positions to count
+        :param prefix: optional int, group string values by their first
+                       'prefix' chars, ie 6 to group dates by month
+        '''
+        numeric = None
+        if prefix:
+            numeric = False
+        column = self.get_column(name, numeric=numeric)
+        if self.use_numpy:
+            values = self._select(column, positions)
+            if column.numeric:
+                keys, counts = numpy.unique(values, return_counts=True)
+            else:
+                keys = column.categories
+                if prefix:
+                    keys, groups = numpy.unique(
+                        keys.astype('U{0}'.format(int(prefix))),
+                        return_inverse=True)
+                    values = groups[values]
+                counts = numpy.bincount(values, minlength=len(keys))
+                found = counts.nonzero()[0]
+                keys = keys[found]
+                counts = counts[found]
+            counts = zip(keys.tolist(), counts.tolist())
+        else:
+            values = self.get_values(name, positions=positions,
+                                     numeric=numeric)
+            if prefix:
+                values = [value[:prefix] for value in values]
+            counts = Counter(values).items()
+        counts.sort(key=lambda count: (-count[1], count[0]))
+        return counts
+
+    def min_max(self, name, positions=None, numeric=None):
+        '''
+        Returns the (min, max) values of attribute 'name', or (None, None)
+        if there are no values.
+        '''
+        column = self.get_column(name, numeric=numeric)
+        if self.use_numpy:
+            values = self._select(column, positions)
+            if not len(values):
+                return None, None
+            if column.numeric:
+                return values.min().item(), values.max().item()
+            return (column.categories[values.min()],
+                    column.categories[values.max()])
+        values = self.get_values(name, positions=positions, numeric=numeric)
+        if not values:
+            return None, None
+        return min(values), max(values)
+
+    def histogram(self, name, positions=None, bins=10):
+        '''
+        Returns a list of ((low, high), count) tuples counting the values of
+        numeric attribute 'name' in 'bins' equal width bins.
+        Raises ValueError if the attribute is not numeric.
+        '''
+        values = self.get_values(name, positions=positions, numeric=True)
+        if not len(values):
+            return []
+        if self.use_numpy:
+            counts, edges = numpy.histogram(values, bins=bins)
+            counts = counts.tolist()
+            edges = edges.tolist()
+        else:
+            low = min(values)
+            high = max(values)
+            if low == high:
+                low -= 0.5
+                high += 0.5
+            width = (high - low) / float(bins)
+            edges = [low + width * x for x in xrange(bins)] + [high]
+            counts = [0] * bins
+            for value in values:
+                index = min(int((value - low) / width), bins - 1)
+                counts[index] += 1
+        return [((edges[x], edges[x + 1]), counts[x]) for x in xrange(bins)]
@@ -0,0 +1,76 @@
+__author__ = 'clarkmatthew'
+
+
+class _TrieNode(object):
+    __slots__ = ('children', 'keys', 'word')
+
+    def __init__(self):
+        # children maps the next char to its node, keys holds those chars
+        # in sorted order.
+        self.children = {}
+        self.keys = []
+        self.word = False
+
+
+class CompletionTrie(object):
+    '''
+    Prefix trie used to look up completion matches for a set of words.
+    Matches are returned in sorted order. The trie is built once from the
+    provided words, create a new trie if the words change.
+    '''
+    def __init__(self, words=None):
+        self._root = _TrieNode()
+        self.words = sorted(set(words or []))
+        # Words are inserted in sorted order so each node's keys are
+        # appended in sorted order as well.
+        for word in self.words:
+            node = self._root
+            for char in word:
+                child = node.children.get(char)
+                if child is None:
+                    child = _TrieNode()
+                    node.children[char] = child
+                    node.keys.append(char)
+                node = child
+            node.word = True
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        node = self._find(word)
+        return node is not None and node.word
+
+    def _find(self, prefix):
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def matches(self, prefix='', limit=None):
+        '''
+        Returns a sorted list of the words starting with 'prefix'.
+        If 'limit' is provided at most 'limit' matches are returned.
+        '''
+        prefix = prefix or ''
+        node = self._find(prefix)
+        ret = []
+        if node is None or limit is not None and limit <= 0:
+            return ret
+        if not prefix:
+            words = self.words
+            if limit is not None:
+                words = words[:limit]
+            return list(words)
+        stack = [(prefix, node)]
+        while stack:
+            word, node = stack.pop()
+            if node.word:
+                ret.append(word)
+                if limit is not None and len(ret) >= limit:
+                    break
+            for char in reversed(node.keys):
+                stack.append((word + char, node.children[char]))
+        return ret
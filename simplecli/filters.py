@@ -0,0 +1,258 @@
+__author__ = 'clarkmatthew'
+
+import heapq
+import operator
+import re
+from collections import OrderedDict
+from itertools import islice
+
+
+##############################################################################
+# Filter expressions select items by their attributes, ie:                  #
+#   os=cirros,centos date=-gt:20120517102326 description=-re.search:text    #
+# Each 'attribute=value1,value2' term matches when any of its values match, #
+# and an item matches a filter when all of the filter's terms match.        #
+# Values may be prefixed with an operator, '-op:' where op is a function in #
+# the operator module (-eq, -ne, -gt, -ge, -lt, -le), or '-re.func:' where  #
+# func is a compiled regex method (-re.search, -re.match). The default      #
+# operator is -eq. List attributes match when they contain the value.       #
+##############################################################################
+
+_op_regex = re.compile("^-+\w\w:")
+_re_op_regex = re.compile("^-+re.\w+:")
+# Compiled regex methods usable as filter operators
+_re_methods = ['search', 'match', 'findall']
+
+
+class ValueMatch(object):
+    '''
+    Matches an attribute value against a single filter value using an
+    operator function. Numeric filter values are converted once, and
+    compared numerically against attribute values which convert to float.
+    '''
+    def __init__(self, op, value):
+        self.op = op
+        self.value = value
+        try:
+            self.float_value = float(value)
+        except ValueError:
+            self.float_value = None
+
+    def __call__(self, attr):
+        if isinstance(attr, list):
+            return self.value in attr
+        if self.float_value is not None:
+            try:
+                return self.op(float(attr), self.float_value)
+            except (ValueError, TypeError):
+                pass
+        return self.op(attr, self.value)
+
+
+class RegexMatch(object):
+    '''
+    Matches an attribute value against a precompiled regex, using the
+    compiled pattern method 'method' (ie 'search' or 'match').
+    '''
+    def __init__(self, method, value):
+        self.value = value
+        self.pattern = re.compile(value)
+        self.method = getattr(self.pattern, method)
+
+    def __call__(self, attr):
+        if isinstance(attr, list):
+            return self.value in attr
+        return self.method(str(attr))
+
+
+class AttributeFilter(object):
+    '''
+    Matches items whose attribute 'name' matches any of 'matches'.
+    'values' holds the filter values the matches were compiled from.
+    Items without the attribute, or with an empty value, do not match.
+    '''
+    def __init__(self, name, matches, values=None):
+        self.name = name
+        self.attr_name = str(name).replace('-', '_')
+        self.matches = matches
+        self.values = values or [match.value for match in matches]
+
+    def __call__(self, item):
+        attr = getattr(item, self.attr_name, None)
+        if not attr:
+            return False
+        for match in self.matches:
+            if match(attr):
+                return True
+        return False
+
+
+class Filter(object):
+    '''
+    Compiled filter expression, see compile_filter().
+    Call with an item to test it, or use filter_items() to select the
+    matching items from a sequence.
+    '''
+    def __init__(self, attribute_filters=None):
+        self.attribute_filters = attribute_filters or []
+
+    def __call__(self, item):
+        for attribute_filter in self.attribute_filters:
+            if not attribute_filter(item):
+                return False
+        return True
+
+    def __nonzero__(self):
+        return bool(self.attribute_filters)
+
+    def __str__(self):
+        return ' '.join('{0}={1}'.format(name, ','.join(values))
+                        for name, values in self.terms.iteritems())
+
+    @property
+    def terms(self):
+        '''
+        Dict of the filter's attribute names to their filter values.
+        '''
+        return OrderedDict((f.name, f.values)
+                           for f in self.attribute_filters)
+
+    def filter_items(self, items, index=None):
+        '''
+        Returns a new list of the items matching this filter.
+        If an ItemIndex (see simplecli.indexes) built over 'items' is
+        provided, the candidate items are found from the index for the terms
+        it can answer, and only those candidates are checked against the
+        remaining terms.
+        '''
+        if not self.attribute_filters:
+            return list(items)
+        if index is None:
+            return [item for item in items if self(item)]
+        return [items[pos] for pos in self.filter_positions(items, index)]
+
+    def filter_positions(self, items, index=None):
+        '''
+        Returns the sorted list of positions of the items matching this
+        filter, see filter_items().
+        '''
+        if not self.attribute_filters:
+            return range(len(items))
+        candidates = None
+        remaining = []
+        if index is not None:
+            for attribute_filter in self.attribute_filters:
+                positions = index.get_positions(attribute_filter)
+                if positions is None:
+                    remaining.append(attribute_filter)
+                elif candidates is None:
+                    candidates = positions
+                else:
+                    candidates = candidates & positions
+        if candidates is None:
+            return [pos for pos, item in enumerate(items) if self(item)]
+        ret = []
+        for pos in sorted(candidates):
+            item = items[pos]
+            for attribute_filter in remaining:
+                if not attribute_filter(item):
+                    break
+            else:
+                ret.append(pos)
+        return ret
+
+
+def _compile_value(value, warn=None):
+    op = _op_regex.search(value)
+    if op:
+        module = operator
+    else:
+        op = _re_op_regex.search(value)
+        module = re
+    if not op:
+        return ValueMatch(operator.eq, value)
+    opstr = op.group()
+    value = value.replace(opstr, '', 1)
+    name = opstr.replace('-', '').strip(':').replace('re.', '')
+    if module is re:
+        if name in _re_methods:
+            return RegexMatch(name, value)
+    else:
+        func = getattr(operator, name, None)
+        if func:
+            return ValueMatch(func, value)
+    if warn:
+        warn('Warning: operator "{0}" ({1}) not valid? for mod:"{2}"'
+             .format(name, opstr, module.__name__))
+    return ValueMatch(operator.eq, value)
+
+
+def compile_filter(filtersarg, warn=None):
+    '''
+    Compiles a filter expression into a Filter.
+    :param filtersarg: string of space separated 'attribute=values' terms,
+                       or a list of terms
+    :param warn: optional method called with warning messages, ie for
+                 invalid operators (which fall back to -eq)
+    Raises ValueError if a term can not be parsed.
+    '''
+    if isinstance(filtersarg, basestring):
+        filtersarg = filtersarg.split()
+    terms = OrderedDict()
+    for item in filtersarg or []:
+        try:
+            name, values = item.split('=', 1)
+        except ValueError:
+            raise ValueError('Could not parse filter argument:"{0}", '
+                             'expected "attribute=value"'.format(item))
+        terms[name] = values.split(',')
+    attribute_filters = []
+    for name, values in terms.iteritems():
+        matches = [_compile_value(value, warn=warn) for value in values]
+        attribute_filters.append(AttributeFilter(name, matches, values))
+    return Filter(attribute_filters)
+
+
+def _get_sort_key(name, reverse=False):
+    # Sorts values numerically when they convert to float, and items
+    # without a value last
+    attr_name = str(name).replace('-', '_')
+
+    def sort_key(item):
+        attr = getattr(item, attr_name, None)
+        if attr is None:
+            return (not reverse, None)
+        try:
+            attr = float(attr)
+        except (ValueError, TypeError):
+            pass
+        return (reverse, attr)
+    return sort_key
+
+
+def select_items(items, sort=None, reverse=False, limit=None, offset=0):
+    '''
+    Returns a list of the items at 'offset' to 'offset' + 'limit', in
+    the order given by attribute 'sort'.
+    When sorting with a limit only the top 'offset' + 'limit' items are
+    kept while reading 'items', in O(n log k) time. Without a sort the items
+    keep their order, and are read only up to the last item returned.
+    :param items: iterable of items
+    :param sort: optional attribute name to sort by
+    :param reverse: boolean, sort in descending order
+    :param limit: optional max number of items to return
+    :param offset: number of leading items to skip
+    '''
+    offset = offset or 0
+    end = None
+    if limit is not None:
+        end = offset + limit
+    if sort:
+        key = _get_sort_key(sort, reverse=reverse)
+        if end is None:
+            items = sorted(items, key=key, reverse=reverse)
+        elif reverse:
+            items = heapq.nlargest(end, items, key=key)
+        else:
+            items = heapq.nsmallest(end, items, key=key)
+    return list(islice(items, offset, end))
@@ -0,0 +1,254 @@
+__author__ = 'clarkmatthew'
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from simplecli import get_dict_from_file
+
+
+class CacheEntry(object):
+    '''
+    A cached response body along with the validators (ETag and Last-Modified)
+    used to revalidate it.
+    '''
+    def __init__(self, url, body, etag=None, last_modified=None,
+                 fetched=None):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched or time.time()
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    @property
+    def age(self):
+        return time.time() - self.fetched
+
+    def _get_meta(self):
+        return {'url': self.url,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+                'fetched': self.fetched}
+
+
+class ResponseCache(object):
+    '''
+    In memory and on disk cache of HTTP GET response bodies.
+    Entries younger than 'ttl' seconds are served without a request. Older
+    entries are revalidated with If-None-Match/If-Modified-Since, and kept
+    if the server replies '304 Not Modified'.
+    The in memory and on disk caches are each kept under 'max_bytes' of
+    body data by evicting the least recently used entries.
+    '''
+    def __init__(self, cache_dir, ttl=300, max_bytes=50 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _get_paths(self, url):
+        key = hashlib.sha1(url).hexdigest()
+        path = os.path.join(self.cache_dir, key)
+        return path + '.json', path + '.body'
+
+    def _load_entry(self, url):
+        if not self.cache_dir:
+            return None
+        meta_path, body_path = self._get_paths(url)
+        try:
+            meta = get_dict_from_file(meta_path)
+            if not meta or meta.get('url') != url:
+                return None
+            body_file = open(body_path, 'rb')
+            with body_file:
+                body = body_file.read()
+        except (IOError, ValueError):
+            return None
+        # Mark as recently used for disk eviction
+        os.utime(meta_path, None)
+        return CacheEntry(url=url,
+                          body=body,
+                          etag=meta.get('etag'),
+                          last_modified=meta.get('last_modified'),
+                          fetched=meta.get('fetched'))
+
+    def _save_entry(self, entry, meta_only=False):
+        if not self.cache_dir:
+            return
+        meta_path, body_path = self._get_paths(entry.url)
+        if not meta_only:
+            body_file = open(body_path, 'wb')
+            with body_file:
+                body_file.write(entry.body)
+        meta_file = open(meta_path, 'w')
+        with meta_file:
+            meta_file.write(json.dumps(entry._get_meta()))
+        if not meta_only:
+            self._evict_disk(keep=meta_path)
+
+    def _evict_disk(self, keep=None):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.cache_dir, name)
+            body_path = meta_path[:-5] + '.body'
+            try:
+                size = os.path.getsize(body_path)
+                used = os.path.getmtime(meta_path)
+            except OSError:
+                continue
+            total += size
+            # The kept entry counts towards the total, but is not evicted
+            if meta_path != keep:
+                entries.append((used, meta_path, body_path, size))
+        entries.sort()
+        while total > self.max_bytes and entries:
+            used, meta_path, body_path, size = entries.pop(0)
+            for path in [meta_path, body_path]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def _store(self, entry):
+        old = self._entries.pop(entry.url, None)
+        if old is not None:
+            self._memory_bytes -= old.size
+        self._entries[entry.url] = entry
+        self._memory_bytes += entry.size
+        while self._memory_bytes > self.max_bytes and len(self._entries) > 1:
+            url, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted.size
+
+    def get_entry(self, url):
+        '''
+        Returns the cached entry for 'url' from memory or disk, or None.
+        '''
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                entry = self._load_entry(url)
+                if entry is None:
+                    return None
+                self._store(entry)
+            else:
+                # Mark as most recently used
+                self._entries[url] = self._entries.pop(url)
+            return entry
+
+    def _get_request_headers(self, entry, headers=None):
+        # Adds the entry's validators as conditional request headers
+        headers = dict(headers or {})
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def _revalidated(self, entry):
+        # Marks a cached entry fresh after a '304 Not Modified' reply
+        with self._lock:
+            entry.fetched = time.time()
+            self._save_entry(entry, meta_only=True)
+
+    def _add_response(self, url, body, response):
+        with self._lock:
+            entry = CacheEntry(url=url,
+                               body=body,
+                               etag=response.headers.get('ETag'),
+                               last_modified=response.headers.get(
+                                   'Last-Modified'))
+            self._store(entry)
+            self._save_entry(entry)
+        return entry
+
+    def get(self, url, refresh=False, session=None, **kwargs):
+        '''
+        Returns the response body for a GET of 'url', from the cache when
+        fresh or still valid.
+        :param refresh: boolean, ignore any cached entry and fetch the url
+        :param session: obj providing get(url, headers=...), ie the env's
+                        HttpClient. Defaults to the requests module.
+        :param kwargs: passed to session.get()
+        '''
+        entry = None
+        if not refresh:
+            entry = self.get_entry(url)
+            if entry is not None and entry.age < self.ttl:
+                return entry.body
+        if session is None:
+            import requests as session
+        headers = self._get_request_headers(entry, kwargs.pop('headers', None))
+        r = session.get(url, headers=headers, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            self._revalidated(entry)
+            return entry.body
+        r.raise_for_status()
+        return self._add_response(url, r.content, r).body
+
+    def iter_content(self, url, refresh=False, session=None,
+                     chunk_size=64 * 1024, **kwargs):
+        '''
+        Like get(), but yields the response body in chunks as it is read,
+        so callers can start parsing it before the whole body has arrived.
+        Fetched bodies are added to the cache once read completely, unless
+        larger than the cache's 'max_bytes'.
+        '''
+        entry = None
+        if not refresh:
+            entry = self.get_entry(url)
+        if entry is None or entry.age >= self.ttl:
+            if session is None:
+                import requests as session
+            headers = self._get_request_headers(entry,
+                                                kwargs.pop('headers', None))
+            r = session.get(url, headers=headers, stream=True, **kwargs)
+            try:
+                if r.status_code == 304 and entry is not None:
+                    self._revalidated(entry)
+                else:
+                    r.raise_for_status()
+                    chunks = []
+                    size = 0
+                    for chunk in r.iter_content(chunk_size):
+                        if chunks is not None:
+                            size += len(chunk)
+                            if size > self.max_bytes:
+                                chunks = None
+                            else:
+                                chunks.append(chunk)
+                        yield chunk
+                    if chunks is not None:
+                        self._add_response(url, ''.join(chunks), r)
+                    return
+            finally:
+                r.close()
+        body = entry.body
+        for start in xrange(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    def invalidate(self, url):
+        with self._lock:
+            entry = self._entries.pop(url, None)
+            if entry is not None:
+                self._memory_bytes -= entry.size
+            if self.cache_dir:
+                for path in self._get_paths(url):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
@@ -0,0 +1,119 @@
+__author__ = 'clarkmatthew'
+
+import threading
+from urlparse import urlparse
+
+
+class HttpClient(object):
+    '''
+    HTTP client shared by menus through BaseEnv.http_client.
+    Wraps a requests Session so connections are pooled and kept alive per
+    host. Requests get default connect/read timeouts, failed connections and
+    5xx replies to idempotent requests are retried with backoff, and the
+    number of requests in flight to any one host is capped.
+    Requires the 'requests' module.
+    '''
+    def __init__(self,
+                 connect_timeout=5,
+                 read_timeout=30,
+                 retries=3,
+                 backoff=0.5,
+                 max_per_host=4,
+                 pool_size=10):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_per_host = max_per_host
+        try:
+            from requests.packages.urllib3.util.retry import Retry
+            max_retries = Retry(total=retries,
+                                backoff_factor=backoff,
+                                status_forcelist=[500, 502, 503, 504])
+        except ImportError:
+            max_retries = retries
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=max(pool_size, max_per_host),
+                              max_retries=max_retries)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def _get_host_limit(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            limit = self._host_limits.get(host)
+            if limit is None:
+                limit = threading.BoundedSemaphore(self.max_per_host)
+                self._host_limits[host] = limit
+        return limit
+
+    def request(self, method, url, **kwargs):
+        '''
+        Sends a request using the pooled session, waiting if 'max_per_host'
+        requests to the url's host are already in flight.
+        With stream=True the body is read after the response is returned,
+        so the request stays in flight until the response is read through
+        iter_content() (or content) or closed. Streamed responses must be
+        read completely or closed.
+        kwargs are passed to requests.Session.request().
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        limit = self._get_host_limit(url)
+        if not kwargs.get('stream'):
+            with limit:
+                return self.session.request(method, url, **kwargs)
+        limit.acquire()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except:
+            limit.release()
+            raise
+        _release_when_done(response, limit)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def _release_when_done(response, limit):
+    # Releases 'limit' once the streamed response's body has been read or
+    # the response is closed, whichever comes first
+    lock = threading.Lock()
+    held = [True]
+
+    def release():
+        with lock:
+            if not held[0]:
+                return
+            held[0] = False
+        limit.release()
+
+    iter_content = response.iter_content
+    close = response.close
+
+    def _iter_content(*args, **kwargs):
+        try:
+            for chunk in iter_content(*args, **kwargs):
+                yield chunk
+        finally:
+            release()
+
+    def _close():
+        try:
+            close()
+        finally:
+            release()
+
+    response.iter_content = _iter_content
+    response.close = _close
@@ -0,0 +1,155 @@
+__author__ = 'clarkmatthew'
+
+import operator
+from bisect import bisect_left, bisect_right
+from simplecli.filters import ValueMatch
+
+
+class HashIndex(object):
+    '''
+    Maps the values of attribute 'name' to the positions of the items having
+    them. For list attributes each list element is indexed.
+    Answers -eq matches on plain attributes and any match on list
+    attributes, see simplecli.filters.
+    '''
+    def __init__(self, name, items):
+        self.name = name
+        self.postings = {}
+        self.kind = None
+        for pos, item in enumerate(items):
+            attr = getattr(item, name, None)
+            if not attr:
+                continue
+            if isinstance(attr, list):
+                kind = 'list'
+                values = attr
+            else:
+                kind = 'scalar'
+                values = [attr]
+            if self.kind is None:
+                self.kind = kind
+            elif self.kind != kind:
+                # Mixed list and plain values, can't answer queries
+                self.kind = 'mixed'
+                self.postings = {}
+                return
+            for value in values:
+                try:
+                    self.postings.setdefault(value, set()).add(pos)
+                except TypeError:
+                    # Unhashable value
+                    self.kind = 'mixed'
+                    self.postings = {}
+                    return
+
+    def get_positions(self, match):
+        '''
+        Returns the set of positions of items matching 'match', or None if
+        this index can not answer the match.
+        '''
+        if self.kind == 'list':
+            return self.postings.get(match.value, set())
+        if (self.kind == 'scalar' and isinstance(match, ValueMatch) and
+                match.op is operator.eq and match.float_value is None):
+            return self.postings.get(match.value, set())
+        if self.kind is None:
+            # No item has a value for this attribute
+            return set()
+        return None
+
+
+class SortedIndex(object):
+    '''
+    Sorted (value, position) pairs for attribute 'name', for answering
+    -eq, -lt, -le, -gt and -ge matches. Values are compared as floats when
+    every value converts to a float, otherwise as they are.
+    '''
+    _ops = [operator.eq, operator.lt, operator.le, operator.gt, operator.ge]
+
+    def __init__(self, name, items):
+        self.name = name
+        self.numeric = True
+        self.usable = True
+        pairs = []
+        for pos, item in enumerate(items):
+            attr = getattr(item, name, None)
+            if not attr:
+                continue
+            if isinstance(attr, list):
+                self.usable = False
+                break
+            pairs.append((attr, pos))
+        if self.usable:
+            try:
+                pairs = [(float(attr), pos) for attr, pos in pairs]
+            except (ValueError, TypeError):
+                self.numeric = False
+        pairs.sort()
+        self.keys = [key for key, pos in pairs]
+        self.positions = [pos for key, pos in pairs]
+
+    def get_positions(self, match):
+        '''
+        Returns the set of positions of items matching 'match', or None if
+        this index can not answer the match.
+        '''
+        if (not self.usable or not isinstance(match, ValueMatch) or
+                match.op not in self._ops):
+            return None
+        if self.numeric:
+            if match.float_value is None:
+                return None
+            value = match.float_value
+        else:
+            if match.float_value is not None:
+                return None
+            value = match.value
+        op = match.op
+        if op is operator.eq:
+            start = bisect_left(self.keys, value)
+            end = bisect_right(self.keys, value)
+        elif op is operator.lt:
+            start, end = 0, bisect_left(self.keys, value)
+        elif op is operator.le:
+            start, end = 0, bisect_right(self.keys, value)
+        elif op is operator.gt:
+            start, end = bisect_right(self.keys, value), len(self.keys)
+        else:
+            start, end = bisect_left(self.keys, value), len(self.keys)
+        return set(self.positions[start:end])
+
+
+class ItemIndex(object):
+    '''
+    Secondary indexes over the attributes of a list of items, used by
+    Filter.filter_items() to find candidate items before checking them.
+    :param items: list of items to index. Positions refer to this list.
+    :param hash_fields: attribute names to build HashIndexes for
+    :param sorted_fields: attribute names to build SortedIndexes for
+    '''
+    def __init__(self, items, hash_fields=None, sorted_fields=None):
+        self.items = items
+        self.indexes = {}
+        for name in hash_fields or []:
+            self.indexes[name] = [HashIndex(name, items)]
+        for name in sorted_fields or []:
+            self.indexes.setdefault(name, []).append(SortedIndex(name, items))
+
+    def get_positions(self, attribute_filter):
+        '''
+        Returns the set of positions of the items matching the
+        AttributeFilter, or None if the indexes can not answer it.
+        '''
+        indexes = self.indexes.get(attribute_filter.attr_name)
+        if not indexes:
+            return None
+        ret = set()
+        for match in attribute_filter.matches:
+            for index in indexes:
+                positions = index.get_positions(match)
+                if positions is not None:
+                    break
+            else:
+                return None
+            ret |= positions
+        return ret
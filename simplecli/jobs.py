@@ -0,0 +1,135 @@
+__author__ = 'clarkmatthew'
+
+import threading
+import time
+from collections import OrderedDict
+from StringIO import StringIO
+
+
+_job_local = threading.local()
+
+
+def current_job():
+    '''
+    Returns the Job being run by the current thread, or None if the current
+    thread is not running a background job.
+    '''
+    return getattr(_job_local, 'job', None)
+
+
+class Job(object):
+    '''
+    A command run in the background by JobManager. Output written by the
+    menu while running the job is collected in 'output'.
+    '''
+    def __init__(self, job_id, menu, line):
+        self.id = job_id
+        self.menu = menu
+        self.line = line
+        self.status = 'running'
+        self.output = StringIO()
+        self.error = None
+        self.result = None
+        self.started = time.time()
+        self.finished = None
+        self.reported = False
+        self.thread = None
+        self.cancelled = threading.Event()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.time()) - self.started
+
+
+class JobManager(object):
+    '''
+    Runs menu commands on background threads, and tracks their status.
+    Commands started with a trailing '&' are run here, see BaseMenu.onecmd().
+    Python threads can not be stopped from outside, so cancelling a job marks
+    it cancelled and discards its output. Long running commands can check
+    the job's 'cancelled' event to stop early.
+    '''
+    def __init__(self):
+        self._jobs = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._jobs.values()))
+
+    def start(self, menu, line):
+        with self._lock:
+            job = Job(self._next_id, menu, line)
+            self._next_id += 1
+            self._jobs[job.id] = job
+        job.thread = threading.Thread(target=self._run, args=(job,),
+                                      name='simplecli-job-' + str(job.id))
+        job.thread.daemon = True
+        job.thread.start()
+        return job
+
+    def _run(self, job):
+        _job_local.job = job
+        try:
+            job.result = job.menu.onecmd(job.line)
+        except SystemExit:
+            pass
+        except Exception as JE:
+            job.error = JE
+        finally:
+            _job_local.job = None
+            job.finished = time.time()
+            if job.cancelled.is_set():
+                job.status = 'cancelled'
+            elif job.error is not None:
+                job.status = 'failed'
+            else:
+                job.status = 'done'
+
+    def get(self, job_id):
+        '''
+        Returns the job for 'job_id', raises ValueError if not found.
+        '''
+        try:
+            return self._jobs[int(job_id)]
+        except (KeyError, ValueError):
+            raise ValueError('Job not found:"{0}"'.format(job_id))
+
+    def wait(self, job_id, timeout=None):
+        '''
+        Waits for the job to finish, and removes it from the job list.
+        Returns the job.
+        '''
+        job = self.get(job_id)
+        job.thread.join(timeout)
+        if job.done:
+            self.remove(job)
+        return job
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        job.cancelled.set()
+        if not job.done:
+            job.status = 'cancelled'
+        self.remove(job)
+        return job
+
+    def remove(self, job):
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def get_finished_unreported(self):
+        '''
+        Returns jobs which have finished since the last call.
+        '''
+        ret = []
+        for job in self:
+            if job.done and not job.reported:
+                job.reported = True
+                ret.append(job)
+        return ret
@@ -0,0 +1,122 @@
+__author__ = 'clarkmatthew'
+
+import json
+
+
+class _ChunkReader(object):
+    '''
+    Buffers string chunks from an iterable, and decodes JSON values from
+    them as enough data arrives. Consumed data is dropped from the buffer.
+    '''
+    _whitespace = ' \t\n\r'
+
+    def __init__(self, chunks, decoder=None):
+        self.chunks = iter(chunks)
+        self.decoder = decoder or json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        '''
+        Reads the next chunk into the buffer, returns False at the end of
+        the chunks.
+        '''
+        for chunk in self.chunks:
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return True
+        self.eof = True
+        return False
+
+    def peek(self):
+        '''
+        Skips whitespace and returns the next char, or '' at the end of the
+        chunks.
+        '''
+        while True:
+            while (self.pos < len(self.buf) and
+                   self.buf[self.pos] in self._whitespace):
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expected "{0}" at offset {1} of JSON stream, '
+                             'found "{2}"'.format(char, self.pos, found))
+        self.pos += 1
+
+    def decode(self):
+        '''
+        Decodes and returns the JSON value at the current position.
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # Incomplete value, read more unless at the end of the chunks
+                if not self.fill():
+                    raise
+                continue
+            if end == len(self.buf) and not self.eof:
+                # A number may continue in the next chunk
+                if self.fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(chunks, key=None, decoder=None):
+    '''
+    Yields the elements of a JSON array one at a time as they are parsed from
+    'chunks', an iterable of strings (ie a response's iter_content()), so
+    elements can be used before the whole document has been read.
+    :param chunks: iterable of strings making up the JSON document
+    :param key: name of the array in the document's top level object. If not
+                given the document itself must be an array. Nothing is yielded
+                if the object has no 'key'.
+    :param decoder: optional json.JSONDecoder used to decode the elements
+    Raises ValueError if the document is not valid JSON.
+    '''
+    reader = _ChunkReader(chunks, decoder=decoder)
+    if key is None:
+        for element in _iter_array(reader):
+            yield element
+        return
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.decode()
+        reader.expect(':')
+        if name == key:
+            for element in _iter_array(reader):
+                yield element
+        else:
+            # Skip this value
+            reader.decode()
+        if reader.peek() == ',':
+            reader.pos += 1
+        else:
+            reader.expect('}')
+            return
+
+
+def _iter_array(reader):
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield reader.decode()
+        if reader.peek() == ',':
+            reader.pos += 1
+        else:
+            reader.expect(']')
+            return
@@ -0,0 +1,135 @@
+__author__ = 'clarkmatthew'
+##############################################################################
+# Runs a single command from the command line and exits. For example:       #
+#   simplecli services_menu block_storage_services_menu show_services       #
+# The menu path is resolved by reading the menu class definitions, and only #
+# the modules of the menu the command is run in are imported.               #
+##############################################################################
+
+import sys
+from optparse import OptionParser
+from simplecli.baseenv import BaseEnv
+from simplecli.plugins import PluginMenu, get_menu_class_info
+
+
+def _import_class(module_name, class_name):
+    __import__(module_name)
+    return getattr(sys.modules[module_name], class_name)
+
+
+def _plugin_parent_matches(plugin, class_name, name):
+    for line in plugin._parents:
+        try:
+            parent_type, parent = str(line).split(':')
+        except ValueError:
+            continue
+        if parent_type.lower() == 'class' and parent == class_name:
+            return True
+        if parent_type.lower() == 'name' and parent == name:
+            return True
+    return False
+
+
+def _find_submenu(env, menu_ref, info, name):
+    '''
+    Returns (module name, class name) of the sub menu named 'name' of the
+    menu class referenced by 'menu_ref', or None if not found.
+    '''
+    module_name, class_name = menu_ref
+    menu_name = None
+    if info:
+        menu_name = info['name']
+        submenus = info['submenus']
+    else:
+        submenus = None
+    if submenus is not None:
+        for ref in submenus:
+            sub_info = get_menu_class_info(*ref)
+            if not sub_info:
+                # Can't be determined statically, check the imported class
+                submenus = None
+                break
+            if sub_info['name'] == name:
+                return ref
+    if submenus is None:
+        menuclass = _import_class(module_name, class_name)
+        menu_name = menuclass.name
+        for submenu in menuclass._submenus or []:
+            if submenu.name == name:
+                return submenu.__module__, submenu.__name__
+    for plugin in env.plugin_menus:
+        if plugin.name != name:
+            continue
+        if not _plugin_parent_matches(plugin, class_name, menu_name):
+            continue
+        if isinstance(plugin, PluginMenu):
+            return plugin.module_name, plugin.class_name
+        return plugin.__class__.__module__, plugin.__class__.__name__
+    if name == 'config_menu':
+        return 'simplecli.basemenu', 'Config_Menu'
+    return None
+
+
+def resolve_menu_path(env, home_menu, words):
+    '''
+    Follows the sub menu names at the start of 'words' from the menu class
+    'home_menu' (in the form 'module.Class').
+    Returns the menu class found at the end of the path, and the remaining
+    words of the command line.
+    '''
+    module_name, class_name = home_menu.rsplit('.', 1)
+    menu_ref = (module_name, class_name)
+    index = 0
+    while index < len(words):
+        submenu = _find_submenu(env, menu_ref,
+                                get_menu_class_info(*menu_ref),
+                                words[index])
+        if not submenu:
+            break
+        menu_ref = submenu
+        index += 1
+    return _import_class(*menu_ref), words[index:]
+
+
+def main(argv=None):
+    parser = OptionParser(
+        usage='%prog [options] [menu ...] command [args]',
+        description='Runs a single command from the menu at the given menu '
+                    'path and exits.')
+    parser.add_option('--home', dest='home_menu', default=None,
+                      help='Home menu class, ie "menutree.homemenu.HomeMenu".'
+                           ' Defaults to the "home_menu" simplecli config')
+    parser.add_option('--base-dir', dest='base_dir', default=None,
+                      help='simplecli base dir, defaults to ~/.simplecli')
+    parser.disable_interspersed_args()
+    options, words = parser.parse_args(argv)
+    env = BaseEnv(base_dir=options.base_dir, interactive=False)
+    env.simplecli_config.page_break = False
+    home_menu = options.home_menu or env.simplecli_config.home_menu
+    if not home_menu:
+        parser.error('Home menu not provided. Use --home or set "home_menu" '
+                     'in the simplecli config')
+    menuclass, words = resolve_menu_path(env, home_menu, words)
+    menu = menuclass(env=env)
+    # Menu changes made by the command switch the active menu rather than
+    # starting the interactive input loop
+    env.active_menu = menu
+    try:
+        if not words:
+            menu.menu_summary('')
+            return 0
+        env.last_error = None
+        try:
+            menu.onecmd(menu.precmd(' '.join(words)))
+        except SystemExit:
+            pass
+        if env.last_error is not None:
+            return 1
+        return 0
+    finally:
+        # Menu output is buffered, see BaseEnv.get_output()
+        env.flush_output()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
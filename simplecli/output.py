@@ -0,0 +1,123 @@
+__author__ = 'clarkmatthew'
+
+import errno
+import os
+import threading
+
+
+class OutputGroup(object):
+    '''
+    Output buffers sharing the same console, ie stdout and stderr. Before a
+    buffer in the group is written to, output pending in the buffer last
+    written to is flushed, so output to both streams keeps its order when
+    they are redirected to the same file.
+    '''
+    def __init__(self):
+        self.buffers = []
+        self.last = None
+        self.lock = threading.Lock()
+
+    def flush(self):
+        with self.lock:
+            for output in self.buffers:
+                output._flush()
+
+
+class OutputBuffer(object):
+    '''
+    File like wrapper collecting writes to 'stream' in memory, and writing
+    them out when flushed, or once 'buffer_size' bytes are buffered. When the
+    stream is not a terminal, buffered output is written straight to the
+    stream's file descriptor.
+    Menus flush their output at the end of each command and before reading
+    input, see BaseEnv.flush_output().
+    :param stream: file object to write to, ie sys.stdout
+    :param buffer_size: number of bytes buffered before writing out
+    :param line_buffered: boolean, write out on every write, defaults to True
+                          when the stream is a terminal
+    :param group: optional OutputGroup this buffer is ordered with
+    '''
+    def __init__(self, stream, buffer_size=65536, line_buffered=None,
+                 group=None):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        try:
+            is_terminal = stream.isatty()
+        except (AttributeError, ValueError):
+            is_terminal = False
+        self.is_terminal = is_terminal
+        if line_buffered is None:
+            line_buffered = is_terminal
+        self.line_buffered = line_buffered
+        self._fd = None
+        if not is_terminal:
+            try:
+                self._fd = stream.fileno()
+            except (AttributeError, IOError, ValueError):
+                self._fd = None
+        self.group = group or OutputGroup()
+        self.group.buffers.append(self)
+        self._buf = []
+        self._buf_len = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        group = self.group
+        with group.lock:
+            last = group.last
+            if last is not self:
+                if last is not None:
+                    last._flush()
+                group.last = self
+            self._buf.append(data)
+            self._buf_len += len(data)
+            if self.line_buffered or self._buf_len >= self.buffer_size:
+                self._flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        '''
+        Writes out the buffered output.
+        '''
+        with self.group.lock:
+            self._flush()
+
+    def _flush(self):
+        # Called with the group's lock held
+        if not self._buf:
+            return
+        data = ''.join(self._buf)
+        self._buf = []
+        self._buf_len = 0
+        if self._fd is None:
+            self.stream.write(data)
+            self.stream.flush()
+            return
+        # Anything written to the stream directly (ie by print) goes first
+        self.stream.flush()
+        self._write_fd(data)
+
+    def _write_fd(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+            except OSError as OE:
+                if OE.errno == errno.EINTR:
+                    continue
+                # Raise as a file object's write would
+                raise IOError(OE.errno, OE.strerror)
+            view = view[written:]
+
+    def fileno(self):
+        return self.stream.fileno()
+
+    def isatty(self):
+        return self.is_terminal
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
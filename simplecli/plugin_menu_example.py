@@ -13,6 +13,13 @@ from fakemodule.imaginary_menu import Imaginary_Menu as MyPlugin
 # example:
 menu_class = MyPlugin
 
+# Note: When 'lazy_plugins' is enabled in the simplecli config, this file is
+# read without being executed, and the menu's module is not imported until
+# the menu is first used. For this to work the menu class should be imported
+# by name from its module (as above), and the class should define 'name'
+# (and optionally '_summary') as plain strings. Otherwise the plugin is
+# imported and loaded on startup.
+
 # parentmenu is either the name of the "menu's class" or the menu's
 # class.name of the parent menu(s) in which this plugin should be made
 # available under as a sub menu.
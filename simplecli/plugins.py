@@ -0,0 +1,380 @@
+__author__ = 'clarkmatthew'
+
+import ast
+import imp
+import json
+import os
+import sys
+from simplecli import get_dict_from_file
+
+
+class PluginMenu(object):
+    '''
+    Lightweight stand-in for a plugin menu. Holds only the information needed
+    to link the plugin under its parent menus (name, summary and parents).
+    The plugin's menu module is imported and the menu class instantiated the
+    first time the 'menu' attribute is accessed, ie when the menu is entered
+    or completed against.
+    '''
+    def __init__(self,
+                 env,
+                 file_path,
+                 module_name,
+                 class_name,
+                 name,
+                 summary=None,
+                 parents=None):
+        self.env = env
+        self.file_path = file_path
+        self.module_name = module_name
+        self.class_name = class_name
+        self.name = name
+        self._summary = summary
+        self._parents = parents or []
+        self._menu = None
+
+    def __repr__(self):
+        return '{0}({1}.{2}, loaded:{3})'.format(self.__class__.__name__,
+                                                 self.module_name,
+                                                 self.class_name,
+                                                 self.loaded)
+
+    @property
+    def class_path(self):
+        return '{0}.{1}'.format(self.module_name, self.class_name)
+
+    @property
+    def loaded(self):
+        return self._menu is not None
+
+    @property
+    def menu(self):
+        if self._menu is None:
+            self._menu = self.load()
+        return self._menu
+
+    def get_menu_class(self):
+        '''
+        Imports the plugin's menu module and returns the menu class.
+        '''
+        __import__(self.module_name)
+        module = sys.modules[self.module_name]
+        menuclass = getattr(module, self.class_name, None)
+        if not menuclass:
+            raise AttributeError('"{0}". Plugin menu class "{1}" not found in '
+                                 'module "{2}"'.format(self.file_path,
+                                                       self.class_name,
+                                                       self.module_name))
+        return menuclass
+
+    def load(self):
+        '''
+        Imports and instantiates the plugin menu, and registers the new menu
+        with the env's loaded menus.
+        '''
+        menuclass = self.get_menu_class()
+        menu = self.env.get_menu_by_class(menuclass)
+        if menu:
+            return menu
+        menu = menuclass(env=self.env)
+        if menu.name != self.name:
+            raise RuntimeError('Plugin menu name mismatch, file:"{0}", '
+                               'expected:"{1}", got:"{2}"'
+                               .format(self.file_path, self.name, menu.name))
+        menu._parents = self._parents
+        self.env.tracer.plugins.debug('Imported lazy plugin menu "{0}" from '
+                                      '"{1}"', self.name, self.module_name)
+        return self.env.menu_registry.register(menu)
+
+    @classmethod
+    def from_file(cls, file_path, env, cache=None):
+        '''
+        Attempts to build a PluginMenu from the plugin file without executing
+        it or importing the menu module.
+        If a PluginCache is provided, the plugin's info will be served from
+        the cache when the plugin file has not changed.
+        Returns None if the plugin's info could not be determined statically,
+        in which case the plugin should be loaded by importing it.
+        '''
+        if cache is not None:
+            info = cache.get_plugin_info(file_path)
+        else:
+            info = get_plugin_info(file_path)
+        if not info:
+            return None
+        return cls(env=env,
+                   file_path=file_path,
+                   module_name=info['module_name'],
+                   class_name=info['class_name'],
+                   name=info['name'],
+                   summary=info['summary'],
+                   parents=info['parents'])
+
+
+def _parse_file(file_path):
+    source = open(file_path, 'r')
+    with source:
+        data = source.read()
+    try:
+        return ast.parse(data, file_path)
+    except SyntaxError:
+        return None
+
+
+def _find_module_source(module_name):
+    '''
+    Returns the path to the source file for the provided module name without
+    importing the module or its packages.
+    '''
+    module = sys.modules.get(module_name)
+    if module is not None:
+        path = getattr(module, '__file__', None)
+        if path and os.path.splitext(path)[1] in ['.pyc', '.pyo']:
+            path = path[:-1]
+        return path
+    path = None
+    mod_type = None
+    try:
+        for part in module_name.split('.'):
+            search_path = None
+            if path:
+                search_path = [path]
+            fh, path, desc = imp.find_module(part, search_path)
+            if fh:
+                fh.close()
+            mod_type = desc[2]
+    except ImportError:
+        return None
+    if mod_type == imp.PKG_DIRECTORY:
+        return os.path.join(path, '__init__.py')
+    if mod_type == imp.PY_SOURCE:
+        return path
+    return None
+
+
+def _get_imports(tree):
+    '''
+    Returns a dict mapping names bound by the module level imports in 'tree'
+    to (module name, imported name). Imported name is None for 'import x'.
+    '''
+    imports = {}
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom):
+            if node.level or not node.module:
+                continue
+            for alias in node.names:
+                imports[alias.asname or alias.name] = (node.module, alias.name)
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                imports[alias.asname or alias.name] = (alias.name, None)
+    return imports
+
+
+def _resolve_class_ref(expr, imports, module_name=None, local_names=None):
+    '''
+    Resolves a reference to a class, ie 'MyMenu' or 'mymodule.MyMenu', to
+    (module name, class name) using the module's imports. Names defined in
+    the module itself ('local_names') resolve to 'module_name'.
+    Returns (None, None) if the reference can not be resolved.
+    '''
+    if isinstance(expr, ast.Name):
+        if expr.id in imports:
+            return imports[expr.id]
+        if local_names and expr.id in local_names:
+            return module_name, expr.id
+    elif (isinstance(expr, ast.Attribute) and
+          isinstance(expr.value, ast.Name) and
+          expr.value.id in imports):
+        ref_module, sub_name = imports[expr.value.id]
+        if sub_name:
+            ref_module = ref_module + '.' + sub_name
+        return ref_module, expr.attr
+    return None, None
+
+
+def _get_class_node(tree, class_name):
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == class_name:
+            return node
+    return None
+
+
+def _get_class_assigns(class_node):
+    '''
+    Returns a dict of the class level 'name = value' assignments in the
+    class definition, mapping name to the value's ast node.
+    '''
+    ret = {}
+    for item in class_node.body:
+        if not isinstance(item, ast.Assign):
+            continue
+        for target in item.targets:
+            if isinstance(target, ast.Name):
+                ret[target.id] = item.value
+    return ret
+
+
+def get_menu_class_info(module_name, class_name):
+    '''
+    Statically reads the definition of the menu class 'class_name' in the
+    module 'module_name' without importing the module.
+    Returns a dict with the menu's module_name, class_name, source_path,
+    name, summary and submenus, or None if the menu's name can not be
+    determined. 'submenus' is a list of (module name, class name) for the
+    class's _submenus, or None if they can not be determined.
+    '''
+    source_path = _find_module_source(module_name)
+    if not source_path or not os.path.isfile(source_path):
+        return None
+    tree = _parse_file(source_path)
+    if not tree:
+        return None
+    class_node = _get_class_node(tree, class_name)
+    if not class_node:
+        return None
+    assigns = _get_class_assigns(class_node)
+    info = {'module_name': module_name,
+            'class_name': class_name,
+            'source_path': source_path,
+            'name': None,
+            'summary': None,
+            'submenus': []}
+    for attr, key in [('name', 'name'), ('_summary', 'summary')]:
+        if attr in assigns:
+            try:
+                info[key] = ast.literal_eval(assigns[attr])
+            except ValueError:
+                pass
+    if not info['name']:
+        return None
+    if '_submenus' in assigns:
+        submenus = assigns['_submenus']
+        if not isinstance(submenus, (ast.List, ast.Tuple)):
+            info['submenus'] = None
+        else:
+            imports = _get_imports(tree)
+            local_names = [node.name for node in tree.body
+                           if isinstance(node, ast.ClassDef)]
+            for expr in submenus.elts:
+                ref = _resolve_class_ref(expr, imports, module_name,
+                                         local_names)
+                if not ref[0]:
+                    info['submenus'] = None
+                    break
+                info['submenus'].append(ref)
+    return info
+
+
+def get_plugin_info(file_path):
+    '''
+    Statically reads a plugin file (see plugin_menu_example.py) and the
+    module its 'menu_class' is imported from.
+    Returns a dict with the menu's module_name, class_name, name, summary and
+    parents, or None if this info can not be determined without
+    importing the plugin.
+    '''
+    tree = _parse_file(file_path)
+    if not tree:
+        return None
+    imports = _get_imports(tree)
+    menu_class = None
+    parents = None
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if not isinstance(target, ast.Name):
+                    continue
+                if target.id == 'menu_class':
+                    menu_class = node.value
+                elif target.id == 'parent_menus':
+                    try:
+                        parents = ast.literal_eval(node.value)
+                    except ValueError:
+                        return None
+    module_name, class_name = _resolve_class_ref(menu_class, imports)
+    if not module_name or not class_name:
+        return None
+    info = get_menu_class_info(module_name, class_name)
+    if not info:
+        return None
+    return {'module_name': module_name,
+            'class_name': class_name,
+            'source_path': info['source_path'],
+            'name': info['name'],
+            'summary': info['summary'],
+            'parents': parents or []}
+
+
+def _get_stamp(file_path):
+    '''
+    Returns [mtime, size] for the file at 'file_path', or None if the file
+    can not be stat'd.
+    '''
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+class PluginCache(object):
+    '''
+    On disk cache of plugin discovery info. Entries are keyed by the plugin
+    file's path and hold the file's mtime and size along with the info read
+    by get_plugin_info(). An entry is used only while the plugin file and
+    its menu module source are unchanged, otherwise it is rebuilt.
+    '''
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.entries = {}
+        self._dirty = False
+        try:
+            self.entries = get_dict_from_file(file_path) or {}
+        except ValueError:
+            # Corrupt cache, start over
+            self._dirty = True
+
+    def get_plugin_info(self, file_path):
+        '''
+        Returns the cached plugin info for the plugin file at 'file_path',
+        reading and caching the plugin info if the entry is missing or stale.
+        '''
+        file_path = os.path.abspath(file_path)
+        stamp = _get_stamp(file_path)
+        entry = self.entries.get(file_path)
+        if entry and stamp and entry.get('stamp') == stamp:
+            info = entry.get('info')
+            if not info:
+                return None
+            if (_get_stamp(info.get('source_path')) ==
+                    entry.get('source_stamp')):
+                return info
+        info = get_plugin_info(file_path)
+        source_stamp = None
+        if info:
+            source_stamp = _get_stamp(info['source_path'])
+        self.entries[file_path] = {'stamp': stamp,
+                                   'source_stamp': source_stamp,
+                                   'info': info}
+        self._dirty = True
+        return info
+
+    def prune(self, file_paths):
+        '''
+        Removes entries for plugin files not found in 'file_paths'.
+        '''
+        keep = set(os.path.abspath(path) for path in file_paths)
+        for path in self.entries.keys():
+            if path not in keep:
+                self.entries.pop(path)
+                self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        cache_file = open(self.file_path, 'w')
+        with cache_file:
+            cache_file.write(json.dumps(self.entries, sort_keys=True,
+                                        indent=4))
+            cache_file.flush()
+        self._dirty = False
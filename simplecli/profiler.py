@@ -0,0 +1,105 @@
+__author__ = 'clarkmatthew'
+
+import cProfile
+import os
+import pstats
+import threading
+import time
+
+
+class CommandProfile(object):
+    '''
+    Profile stats of the runs of one command, aggregated across runs.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.runs = 0
+        self.elapsed = 0
+        self.stats = None
+
+    def add(self, profile, elapsed):
+        self.runs += 1
+        self.elapsed += elapsed
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+
+    def get_hotspots(self, limit=None):
+        '''
+        Returns a list of (function, ncalls, tottime, cumtime) tuples for
+        the functions run by the command, highest cumulative time first.
+        'function' is formatted as 'file:line(name)'.
+        '''
+        if self.stats is None:
+            return []
+        hotspots = []
+        for func, (cc, nc, tt, ct, callers) in self.stats.stats.iteritems():
+            hotspots.append((pstats.func_std_string(func), nc, tt, ct))
+        hotspots.sort(key=lambda hotspot: hotspot[3], reverse=True)
+        if limit:
+            hotspots = hotspots[:limit]
+        return hotspots
+
+
+class CommandProfiler(object):
+    '''
+    Runs menu commands under cProfile while enabled, and keeps the stats
+    per command name, see BaseMenu.onecmd(). Commands run by other commands
+    (ie through sub menus) are part of the outer command's profile.
+    :param dump_dir: optional dir a pstats file is written to for each
+                     profiled command, for use with pstats or other tools
+    '''
+    def __init__(self, dump_dir=None):
+        self.enabled = False
+        self.dump_dir = dump_dir
+        self.profiles = {}
+        self._lock = threading.Lock()
+        # Set while a command is profiled in the current thread
+        self._local = threading.local()
+
+    def runcall(self, name, func, *args, **kwargs):
+        '''
+        Returns func(*args, **kwargs), run under the profiler if enabled.
+        Stats are added to the CommandProfile for command 'name'.
+        '''
+        if not self.enabled or getattr(self._local, 'active', False):
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        self._local.active = True
+        start = time.time()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            self._local.active = False
+            self._add(name, profile, elapsed)
+
+    def _add(self, name, profile, elapsed):
+        profile.create_stats()
+        with self._lock:
+            command_profile = self.profiles.get(name)
+            if command_profile is None:
+                command_profile = CommandProfile(name)
+                self.profiles[name] = command_profile
+            command_profile.add(profile, elapsed)
+        if self.dump_dir:
+            if not os.path.isdir(self.dump_dir):
+                os.makedirs(self.dump_dir)
+            filename = '{0}-{1}-{2:03d}.pstats'.format(
+                name.replace(os.sep, '_'), time.strftime('%Y%m%d-%H%M%S'),
+                int(time.time() * 1000) % 1000)
+            profile.dump_stats(os.path.join(self.dump_dir, filename))
+
+    def get_profiles(self):
+        '''
+        Returns the CommandProfiles, longest total time first.
+        '''
+        with self._lock:
+            profiles = self.profiles.values()
+        profiles.sort(key=lambda profile: profile.elapsed, reverse=True)
+        return profiles
+
+    def clear(self):
+        with self._lock:
+            self.profiles = {}
@@ -0,0 +1,72 @@
+__author__ = 'clarkmatthew'
+
+from collections import OrderedDict
+
+
+class MenuRegistry(object):
+    '''
+    Holds the menu instances loaded in an env, indexed by menu class and by
+    menu name for constant time lookups. Iterates in the order menus were
+    registered, and provides the list methods previously used with
+    BaseEnv.menu_instances (append, remove, len, iteration, indexing).
+    Only one menu instance is held per menu class. When more than one menu
+    shares a name, lookups by name return the first one registered.
+    '''
+    def __init__(self, menus=None):
+        self._by_class = OrderedDict()
+        self._by_name = {}
+        for menu in menus or []:
+            self.register(menu)
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__, list(self))
+
+    def __iter__(self):
+        return iter(self._by_class.values())
+
+    def __len__(self):
+        return len(self._by_class)
+
+    def __contains__(self, menu):
+        return self._by_class.get(menu.__class__) is menu
+
+    def __getitem__(self, index):
+        return self._by_class.values()[index]
+
+    def register(self, menu):
+        '''
+        Adds a menu instance to the registry. If an instance of the same
+        class is already registered the existing instance is kept.
+        Returns the registered instance for the menu's class.
+        '''
+        existing = self._by_class.get(menu.__class__)
+        if existing is not None:
+            return existing
+        self._by_class[menu.__class__] = menu
+        self._by_name.setdefault(menu.name, menu)
+        return menu
+
+    def unregister(self, menu):
+        '''
+        Removes a menu instance from the registry.
+        Raises ValueError if the menu is not registered.
+        '''
+        if self._by_class.get(menu.__class__) is not menu:
+            raise ValueError('Menu not registered:' + str(menu))
+        self._by_class.pop(menu.__class__)
+        if self._by_name.get(menu.name) is menu:
+            self._by_name.pop(menu.name)
+            for other in self._by_class.itervalues():
+                if other.name == menu.name:
+                    self._by_name[menu.name] = other
+                    break
+
+    # List style aliases for existing callers of env.menu_instances
+    append = register
+    remove = unregister
+
+    def get_by_class(self, menuclass):
+        return self._by_class.get(menuclass)
+
+    def get_by_name(self, name):
+        return self._by_name.get(name)
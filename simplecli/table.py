@@ -0,0 +1,152 @@
+__author__ = 'clarkmatthew'
+
+
+class TableFormat(object):
+    '''
+    Draws rows of values as a text table, in the same style as texttable:
+
+        +--------+-------+
+        |   OS   | COUNT |
+        +========+=======+
+        | ubuntu |    13 |
+        +--------+-------+
+
+    Column widths are found in one pass over the rows drawn, and kept, so
+    later tables drawn with the same format are at least as wide and line
+    up with earlier ones. Once widths are known, rows can be streamed a line
+    at a time with iter_lines().
+    :param header: optional list of column headers
+    :param align: optional list of 'l', 'r' or 'c' per column, default 'l'
+    :param hlines: boolean, draw a line between rows
+    :param max_width: optional max table width, ie the terminal width. The
+                      widest columns are narrowed to fit, and their cells
+                      wrapped.
+    '''
+    _align_chars = {'l': '<', 'r': '>', 'c': '^'}
+    # Columns are not narrowed below this width to fit max_width
+    _min_width = 8
+
+    def __init__(self, header=None, align=None, hlines=True, max_width=None):
+        self.header = None
+        if header:
+            self.header = [str(value) for value in header]
+        self.align = align
+        self.hlines = hlines
+        self.max_width = max_width
+        self.widths = []
+        self._draw_widths = []
+        self._formats = None
+
+    def set_max_width(self, max_width):
+        if max_width != self.max_width:
+            self.max_width = max_width
+            self._formats = None
+
+    def _get_draw_widths(self):
+        # Returns the column widths narrowed to fit max_width
+        widths = list(self.widths)
+        if self.max_width:
+            over = sum(widths) + 3 * len(widths) + 1 - self.max_width
+            while over > 0:
+                widest = max(widths)
+                if widest <= self._min_width:
+                    break
+                widths[widths.index(widest)] -= 1
+                over -= 1
+        return widths
+
+    def fit(self, rows):
+        '''
+        Widens the columns to fit 'rows', a list of lists of strings.
+        '''
+        widths = list(self.widths)
+        for row in rows:
+            if len(row) > len(widths):
+                widths.extend([0] * (len(row) - len(widths)))
+            for x, value in enumerate(row):
+                length = len(value)
+                if length > widths[x]:
+                    if '\n' in value:
+                        length = max(len(line) for line in value.splitlines())
+                        if length <= widths[x]:
+                            continue
+                    widths[x] = length
+        if widths != self.widths:
+            self.widths = widths
+            self._formats = None
+
+    def _get_formats(self):
+        # Returns the row format, header format and line strings for the
+        # current widths
+        if self._formats is None:
+            self._draw_widths = self._get_draw_widths()
+            align = self.align or []
+            cells = []
+            for x, width in enumerate(self._draw_widths):
+                char = 'l'
+                if x < len(align):
+                    char = align[x]
+                cells.append('{{{0}:{1}{2}}}'.format(
+                    x, self._align_chars.get(char, '<'), width))
+            header = ['{{{0}:^{1}}}'.format(x, width)
+                      for x, width in enumerate(self._draw_widths)]
+            dashes = ['-' * (width + 2) for width in self._draw_widths]
+            equals = ['=' * (width + 2) for width in self._draw_widths]
+            self._formats = ('| ' + ' | '.join(cells) + ' |',
+                             '| ' + ' | '.join(header) + ' |',
+                             '+' + '+'.join(dashes) + '+',
+                             '+' + '+'.join(equals) + '+')
+        return self._formats
+
+    def _format_row(self, row_format, row):
+        widths = self._draw_widths
+        if len(row) < len(widths):
+            row = list(row) + [''] * (len(widths) - len(row))
+        for x, value in enumerate(row):
+            if '\n' in value or len(value) > widths[x]:
+                break
+        else:
+            return [row_format.format(*row)]
+        # Draw a line for each line of the multi line or wrapped cells
+        cells = []
+        for x, value in enumerate(row):
+            width = max(widths[x], 1)
+            lines = []
+            for line in value.splitlines() or ['']:
+                lines.extend([line[y:y + width]
+                              for y in xrange(0, len(line), width)] or [''])
+            cells.append(lines)
+        count = max(len(lines) for lines in cells)
+        return [row_format.format(*[lines[y] if y < len(lines) else ''
+                                    for lines in cells])
+                for y in xrange(count)]
+
+    def iter_lines(self, rows, header=True):
+        '''
+        Yields the lines of the table for 'rows', an iterable of lists of
+        strings, using the current column widths (see fit()).
+        :param header: boolean, draw the header
+        '''
+        row_format, header_format, line, header_line = self._get_formats()
+        yield line
+        if header and self.header:
+            for text in self._format_row(header_format, self.header):
+                yield text
+            yield header_line
+        for row in rows:
+            for text in self._format_row(row_format, row):
+                yield text
+            if self.hlines:
+                yield line
+        if not self.hlines:
+            yield line
+
+    def draw(self, rows, header=True):
+        '''
+        Returns the table for 'rows', a list of lists of values, as a string.
+        '''
+        rows = [[str(value) for value in row] for row in rows]
+        if header and self.header:
+            self.fit([self.header])
+        self.fit(rows)
+        return '\n'.join(self.iter_lines(rows, header=header))
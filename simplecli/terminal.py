@@ -0,0 +1,99 @@
+__author__ = 'clarkmatthew'
+
+import os
+import signal
+import threading
+
+
+class TerminalSize(object):
+    '''
+    Size of the terminal attached to 'stream', shared through
+    BaseEnv.terminal so menus don't query the terminal on every print.
+    The size is read once, and again after the terminal is resized (when
+    watch() has installed the SIGWINCH handler). If 'stream' is not a
+    terminal the size comes from the LINES and COLUMNS environment
+    variables, or 'default', and 'is_terminal' is False.
+    :param stream: file object of the terminal, ie sys.stdout
+    :param default: (height, width) used when the size can not be read
+    '''
+    def __init__(self, stream=None, default=(24, 80)):
+        self.stream = stream
+        self.default = default
+        self._size = None
+        self._is_terminal = False
+
+    @property
+    def size(self):
+        '''
+        The terminal's (height, width).
+        '''
+        size = self._size
+        if size is None:
+            size = self._read_size()
+            self._size = size
+        return size
+
+    @property
+    def is_terminal(self):
+        '''
+        True if the size was read from a terminal.
+        '''
+        self.size
+        return self._is_terminal
+
+    @property
+    def height(self):
+        return self.size[0]
+
+    @property
+    def width(self):
+        return self.size[1]
+
+    def _read_size(self):
+        height, width = self.default
+        try:
+            import fcntl
+            import struct
+            import termios
+            rows, columns = struct.unpack(
+                'hh', fcntl.ioctl(self.stream.fileno(), termios.TIOCGWINSZ,
+                                  '1234'))
+        except Exception:
+            rows, columns = 0, 0
+        self._is_terminal = rows > 0 and columns > 0
+        if not self._is_terminal:
+            try:
+                rows = int(os.environ.get('LINES', 0))
+                columns = int(os.environ.get('COLUMNS', 0))
+            except ValueError:
+                rows, columns = 0, 0
+        if rows > 0:
+            height = rows
+        if columns > 0:
+            width = columns
+        return height, width
+
+    def invalidate(self):
+        '''
+        Marks the size as changed, it is read again on next use.
+        '''
+        self._size = None
+
+    def watch(self):
+        '''
+        Installs a SIGWINCH handler which invalidates the size when the
+        terminal is resized. Signal handlers can only be installed from the
+        main thread, returns False if the handler could not be installed.
+        '''
+        if (not hasattr(signal, 'SIGWINCH') or
+                not isinstance(threading.current_thread(),
+                               threading._MainThread)):
+            return False
+        previous = signal.getsignal(signal.SIGWINCH)
+
+        def _resized(signum, frame):
+            self.invalidate()
+            if callable(previous):
+                previous(signum, frame)
+        signal.signal(signal.SIGWINCH, _resized)
+        return True
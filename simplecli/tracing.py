@@ -0,0 +1,171 @@
+__author__ = 'clarkmatthew'
+
+import sys
+import threading
+import time
+
+# Trace levels, messages at or above a channel's level are written
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVELS = {'debug': DEBUG,
+          'info': INFO,
+          'warning': WARNING,
+          'error': ERROR,
+          'off': OFF}
+
+
+def get_level(name):
+    '''
+    Returns the trace level for 'name', ie 'debug', or an int level.
+    Raises ValueError for unknown level names.
+    '''
+    if name is None:
+        return OFF
+    if isinstance(name, int):
+        return name
+    try:
+        return LEVELS[str(name).strip().lower()]
+    except KeyError:
+        raise ValueError('Unknown trace level "{0}", use one of: {1}'
+                         .format(name, ', '.join(sorted(LEVELS,
+                                                        key=LEVELS.get))))
+
+
+class TraceChannel(object):
+    '''
+    Trace messages for one category, ie 'completion'. Messages are format
+    strings with their arguments, only formatted (with str.format) when the
+    channel's level lets them through, so disabled tracing costs a single
+    comparison:
+
+        tracer.completion.debug('matches for "{0}": {1}', text, matches)
+
+    Channels are true when debug messages are enabled, to guard tracing
+    which needs extra work to build its arguments.
+    '''
+    def __init__(self, tracer, category, level=OFF):
+        self.tracer = tracer
+        self.category = category
+        self.level = level
+
+    def __nonzero__(self):
+        return self.level <= DEBUG
+
+    def debug(self, msg, *args):
+        if self.level > DEBUG:
+            return
+        self.tracer.write(self.category, 'DEBUG', msg, args)
+
+    def info(self, msg, *args):
+        if self.level > INFO:
+            return
+        self.tracer.write(self.category, 'INFO', msg, args)
+
+    def warning(self, msg, *args):
+        if self.level > WARNING:
+            return
+        self.tracer.write(self.category, 'WARNING', msg, args)
+
+    def error(self, msg, *args):
+        if self.level > ERROR:
+            return
+        self.tracer.write(self.category, 'ERROR', msg, args)
+
+
+class Tracer(object):
+    '''
+    Leveled trace messages in per subsystem categories, shared through
+    BaseEnv.tracer. Messages are written to 'stream' (ie stderr), or
+    appended to the file at 'path' when set.
+    The built in categories are available as attributes, ie
+    tracer.completion. Other categories are created with get().
+    :param stream: file like obj messages are written to without a path
+    '''
+    categories = ['completion', 'dispatch', 'plugins', 'config']
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.path = None
+        self.level = OFF
+        # Categories the level applies to, None for all
+        self.enabled_categories = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._channels = {}
+        for category in self.categories:
+            setattr(self, category, self.get(category))
+
+    def get(self, category):
+        '''
+        Returns the TraceChannel for 'category', creating it if needed.
+        '''
+        channel = self._channels.get(category)
+        if channel is None:
+            channel = TraceChannel(self, category,
+                                   level=self._get_category_level(category))
+            self._channels[category] = channel
+        return channel
+
+    def _get_category_level(self, category):
+        if (self.enabled_categories is not None and
+                category not in self.enabled_categories):
+            return OFF
+        return self.level
+
+    def configure(self, level=None, categories=None, path=None):
+        '''
+        Sets the level and destination of trace messages.
+        :param level: level name or int, None or 'off' to disable tracing
+        :param categories: optional list of categories to trace, or a comma
+                           separated string of them. Defaults to all.
+        :param path: optional file path messages are appended to instead of
+                     being written to the stream
+        '''
+        level = get_level(level)
+        if isinstance(categories, basestring):
+            categories = [name.strip() for name in categories.split(',')
+                          if name.strip()]
+            if 'all' in categories:
+                categories = None
+        with self._lock:
+            if path != self.path:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self.path = path
+            self.level = level
+            self.enabled_categories = None
+            if categories:
+                self.enabled_categories = set(categories)
+            for category, channel in self._channels.iteritems():
+                channel.level = self._get_category_level(category)
+
+    def write(self, category, level_name, msg, args):
+        '''
+        Formats and writes a trace message. Used by TraceChannel.
+        '''
+        if args:
+            try:
+                msg = msg.format(*args)
+            except Exception as FE:
+                msg = '{0!r} {1!r} (format error:{2})'.format(msg, args, FE)
+        line = '{0} {1} {2}: {3}\n'.format(
+            time.strftime('%H:%M:%S'), level_name, category, msg)
+        with self._lock:
+            if self.path:
+                if self._file is None:
+                    self._file = open(self.path, 'a', 1)
+                self._file.write(line)
+            else:
+                stream = self.stream or sys.stderr
+                stream.write(line)
+                stream.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,73 @@
+__author__ = 'clarkmatthew'
+
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class LocalServer(object):
+    '''
+    HTTP server run in a thread on a local port, serving the bodies set
+    with set_body(). Replies '304 Not Modified' to conditional requests
+    matching a body's ETag or Last-Modified. Requests are recorded in
+    'requests' as (path, headers dict, status) tuples.
+    '''
+    def __init__(self):
+        self.bodies = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def url(self, path):
+        return 'http://127.0.0.1:{0}{1}'.format(self.port, path)
+
+    def set_body(self, path, body, etag=None, last_modified=None):
+        self.bodies[path] = (body, etag, last_modified)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+    def _handle(self, handler):
+        headers = dict((key.lower(), value)
+                       for key, value in handler.headers.items())
+        if handler.path not in self.bodies:
+            status = 404
+            body, etag, last_modified = 'not found', None, None
+        else:
+            body, etag, last_modified = self.bodies[handler.path]
+            status = 200
+            if etag and headers.get('if-none-match') == etag:
+                status = 304
+            elif (last_modified and
+                    headers.get('if-modified-since') == last_modified):
+                status = 304
+        self.requests.append((handler.path, headers, status))
+        handler.send_response(status)
+        if etag:
+            handler.send_header('ETag', etag)
+        if last_modified:
+            handler.send_header('Last-Modified', last_modified)
+        if status == 304:
+            handler.end_headers()
+            return
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
@@ -0,0 +1,123 @@
+__author__ = 'clarkmatthew'
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from http_server import LocalServer
+from simplecli.filters import compile_filter
+from simplecli.httpcache import ResponseCache
+from simplecli.jsonstream import iter_json_array
+from menutree.images.catalog_store import CatalogStore
+from menutree.images.images_menu import CatalogImage
+
+
+def make_image(name, os_name='ubuntu', date='20140101000000',
+               stamp='0000-0001', hypervisors=None):
+    return {'architecture': 'x86_64',
+            'contact': 'images@example.com',
+            'date': date,
+            'description': 'Image ' + name,
+            'hypervisors-supported': hypervisors or ['kvm'],
+            'name': name,
+            'os': os_name,
+            'recipe': 'recipe',
+            'single-kernel': False,
+            'stamp': stamp,
+            'url': 'images/{0}.tgz'.format(name),
+            'version': '1'}
+
+
+class CatalogStoreTest(unittest.TestCase):
+    '''
+    Syncs a CatalogStore from a catalog served by a local HTTP server, the
+    same way the images menu's sync_catalog does.
+    '''
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = LocalServer().start()
+        self.url = self.server.url('/catalog')
+        self.cache = ResponseCache(cache_dir=None, ttl=0)
+        self.store = CatalogStore(os.path.join(self.tmp_dir, 'catalog.db'),
+                                  image_class=CatalogImage)
+
+    def tearDown(self):
+        self.store.close()
+        if self.server is not None:
+            self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def serve(self, images):
+        self.server.set_body('/catalog', json.dumps({'images': images}))
+
+    def sync(self):
+        chunks = self.cache.iter_content(self.url, refresh=True)
+        return self.store.sync(iter_json_array(chunks, key='images'),
+                               url=self.url)
+
+    def get_names(self, filters=None):
+        if filters is not None:
+            filters = compile_filter(filters)
+        return [image.name for image in self.store.query(filters)]
+
+    def test_sync_counts(self):
+        images = [make_image('a'), make_image('b'), make_image('c')]
+        self.serve(images)
+        self.assertEqual(self.sync(), {'added': 3, 'updated': 0,
+                                       'deleted': 0, 'unchanged': 0})
+        images[1] = make_image('b', stamp='0000-0002')
+        images.append(make_image('d'))
+        del images[0]
+        self.serve(images)
+        self.assertEqual(self.sync(), {'added': 1, 'updated': 1,
+                                       'deleted': 1, 'unchanged': 1})
+        meta = self.store.get_meta()
+        self.assertEqual(meta['images'], 3)
+        self.assertEqual(meta['url'], self.url)
+        self.assertEqual(self.store.query(compile_filter('name=b'))[0].stamp,
+                         '0000-0002')
+
+    def test_query_offline(self):
+        self.serve([make_image('a', os_name='centos', date='20120101000000'),
+                    make_image('b', date='20130101000000',
+                               hypervisors=['kvm', 'vmware']),
+                    make_image('c', date='20140101000000')])
+        self.sync()
+        # Queries only use the local store
+        self.server.stop()
+        self.server = None
+        self.assertEqual(self.get_names('os=ubuntu'), ['b', 'c'])
+        self.assertEqual(self.get_names('os=ubuntu,centos'), ['a', 'b', 'c'])
+        self.assertEqual(self.get_names('date=-gt:20120601000000'),
+                         ['b', 'c'])
+        self.assertEqual(self.get_names('hypervisors_supported=vmware'),
+                         ['b'])
+        self.assertEqual(self.get_names('os=ubuntu date=-lt:20140101000000'),
+                         ['b'])
+        self.assertEqual(self.get_names('description=-re.search:Image.c'),
+                         ['c'])
+
+    def test_catalog_order(self):
+        images = [make_image(name) for name in ['a', 'b', 'c', 'd']]
+        self.serve(images)
+        self.sync()
+        self.assertEqual(self.get_names(), ['a', 'b', 'c', 'd'])
+        # Updated images keep their place in the catalog
+        images[1] = make_image('b', stamp='0000-0002')
+        self.serve(images)
+        self.sync()
+        self.assertEqual(self.get_names(), ['a', 'b', 'c', 'd'])
+        # Unchanged images follow the catalog's order
+        images = [images[3], images[2], make_image('e'), images[0],
+                  images[1]]
+        self.serve(images)
+        counts = self.sync()
+        self.assertEqual(counts['unchanged'], 4)
+        self.assertEqual(self.get_names(), ['d', 'c', 'e', 'a', 'b'])
+        self.assertEqual(self.get_names('os=ubuntu'),
+                         ['d', 'c', 'e', 'a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
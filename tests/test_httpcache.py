@@ -0,0 +1,124 @@
+__author__ = 'clarkmatthew'
+
+import os
+import shutil
+import tempfile
+import unittest
+from http_server import LocalServer
+from simplecli.httpcache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    '''
+    Fetches through a ResponseCache from a local HTTP server, checking which
+    requests reach the server.
+    '''
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = LocalServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def get_statuses(self, path):
+        return [status for (request_path, headers, status)
+                in self.server.requests if request_path == path]
+
+    def test_ttl_hit(self):
+        self.server.set_body('/a', 'body a', etag='"a1"')
+        cache = ResponseCache(cache_dir=self.tmp_dir, ttl=300)
+        url = self.server.url('/a')
+        self.assertEqual(cache.get(url), 'body a')
+        self.server.set_body('/a', 'body a2', etag='"a2"')
+        self.assertEqual(cache.get(url), 'body a')
+        self.assertEqual(''.join(cache.iter_content(url)), 'body a')
+        # Fresh entries are also served from disk by a new cache
+        cache = ResponseCache(cache_dir=self.tmp_dir, ttl=300)
+        self.assertEqual(cache.get(url), 'body a')
+        self.assertEqual(self.get_statuses('/a'), [200])
+
+    def test_etag_revalidation(self):
+        self.server.set_body('/a', 'body a', etag='"a1"')
+        cache = ResponseCache(cache_dir=self.tmp_dir, ttl=0)
+        url = self.server.url('/a')
+        self.assertEqual(cache.get(url), 'body a')
+        self.assertEqual(cache.get(url), 'body a')
+        self.assertEqual(''.join(cache.iter_content(url)), 'body a')
+        self.assertEqual(self.get_statuses('/a'), [200, 304, 304])
+        self.assertEqual(self.server.requests[1][1].get('if-none-match'),
+                         '"a1"')
+        self.server.set_body('/a', 'body a2', etag='"a2"')
+        self.assertEqual(cache.get(url), 'body a2')
+        self.assertEqual(self.get_statuses('/a'), [200, 304, 304, 200])
+
+    def test_last_modified_revalidation(self):
+        modified = 'Wed, 01 Jan 2014 00:00:00 GMT'
+        self.server.set_body('/a', 'body a', last_modified=modified)
+        cache = ResponseCache(cache_dir=self.tmp_dir, ttl=0)
+        url = self.server.url('/a')
+        self.assertEqual(cache.get(url), 'body a')
+        # Validators are kept on disk
+        cache = ResponseCache(cache_dir=self.tmp_dir, ttl=0)
+        self.assertEqual(cache.get(url), 'body a')
+        self.assertEqual(self.get_statuses('/a'), [200, 304])
+        headers = self.server.requests[1][1]
+        self.assertEqual(headers.get('if-modified-since'), modified)
+        self.assertNotIn('if-none-match', headers)
+
+    def test_memory_eviction(self):
+        cache = ResponseCache(cache_dir=None, ttl=300, max_bytes=25)
+        for path in ['/a', '/b', '/c']:
+            self.server.set_body(path, path[1] * 10)
+        cache.get(self.server.url('/a'))
+        cache.get(self.server.url('/b'))
+        # Using 'a' makes 'b' the least recently used
+        cache.get(self.server.url('/a'))
+        cache.get(self.server.url('/c'))
+        self.assertIsNone(cache.get_entry(self.server.url('/b')))
+        self.assertEqual(cache.get_entry(self.server.url('/a')).body,
+                         'a' * 10)
+        self.assertEqual(cache.get_entry(self.server.url('/c')).body,
+                         'c' * 10)
+        self.assertEqual(self.get_statuses('/a'), [200])
+
+    def test_disk_eviction(self):
+        for path in ['/a', '/b', '/c']:
+            self.server.set_body(path, path[1] * 10)
+        cache = ResponseCache(cache_dir=self.tmp_dir, ttl=300, max_bytes=25)
+        cache.get(self.server.url('/a'))
+        cache.get(self.server.url('/b'))
+        # Age both entries on disk, then use 'a' from a new cache so 'b' is
+        # the least recently used
+        for name in os.listdir(self.tmp_dir):
+            os.utime(os.path.join(self.tmp_dir, name), (1, 1))
+        cache = ResponseCache(cache_dir=self.tmp_dir, ttl=300, max_bytes=25)
+        self.assertEqual(cache.get(self.server.url('/a')), 'a' * 10)
+        cache.get(self.server.url('/c'))
+        cache = ResponseCache(cache_dir=self.tmp_dir, ttl=300, max_bytes=25)
+        self.assertIsNone(cache.get_entry(self.server.url('/b')))
+        self.assertEqual(cache.get_entry(self.server.url('/a')).body,
+                         'a' * 10)
+        self.assertEqual(cache.get_entry(self.server.url('/c')).body,
+                         'c' * 10)
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 4)
+
+    def test_refresh(self):
+        self.server.set_body('/a', 'body a', etag='"a1"')
+        cache = ResponseCache(cache_dir=self.tmp_dir, ttl=300)
+        url = self.server.url('/a')
+        cache.get(url)
+        self.server.set_body('/a', 'body a2', etag='"a2"')
+        self.assertEqual(cache.get(url), 'body a')
+        self.assertEqual(cache.get(url, refresh=True), 'body a2')
+        # Refreshed requests are not conditional
+        self.assertNotIn('if-none-match', self.server.requests[-1][1])
+        self.server.set_body('/a', 'body a3', etag='"a3"')
+        self.assertEqual(''.join(cache.iter_content(url, refresh=True)),
+                         'body a3')
+        self.assertEqual(cache.get(url), 'body a3')
+        self.assertEqual(self.get_statuses('/a'), [200, 200, 200])
+
+
+if __name__ == '__main__':
+    unittest.main()
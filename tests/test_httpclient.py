@@ -0,0 +1,69 @@
+__author__ = 'clarkmatthew'
+
+import threading
+import unittest
+from http_server import LocalServer
+from simplecli.httpcache import ResponseCache
+from simplecli.httpclient import HttpClient
+
+
+class HttpClientTest(unittest.TestCase):
+    '''
+    Checks the per host cap on requests in flight against a local HTTP
+    server.
+    '''
+    def setUp(self):
+        self.server = LocalServer().start()
+        self.server.set_body('/a', 'a' * 1000)
+        self.client = HttpClient(max_per_host=1, retries=0)
+        self.url = self.server.url('/a')
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def start_get(self):
+        # Starts a GET in a thread, returns the thread and an event set once
+        # the GET has returned
+        done = threading.Event()
+
+        def _get():
+            self.client.get(self.url)
+            done.set()
+        thread = threading.Thread(target=_get)
+        thread.daemon = True
+        thread.start()
+        return thread, done
+
+    def test_stream_holds_slot_until_read(self):
+        response = self.client.get(self.url, stream=True)
+        thread, done = self.start_get()
+        self.assertFalse(done.wait(0.3))
+        self.assertEqual(''.join(response.iter_content(100)), 'a' * 1000)
+        self.assertTrue(done.wait(5))
+        thread.join()
+
+    def test_stream_holds_slot_until_closed(self):
+        response = self.client.get(self.url, stream=True)
+        thread, done = self.start_get()
+        self.assertFalse(done.wait(0.3))
+        response.close()
+        self.assertTrue(done.wait(5))
+        thread.join()
+        # Closing again does not release the slot twice
+        response.close()
+
+    def test_cache_iter_content_releases_slot(self):
+        cache = ResponseCache(cache_dir=None, ttl=0)
+        chunks = cache.iter_content(self.url, session=self.client,
+                                    chunk_size=100)
+        self.assertEqual(next(chunks), 'a' * 100)
+        thread, done = self.start_get()
+        self.assertFalse(done.wait(0.3))
+        chunks.close()
+        self.assertTrue(done.wait(5))
+        thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()